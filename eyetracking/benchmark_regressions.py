@@ -0,0 +1,83 @@
+"""
+Бенчмарк подсчета возвратных саккад: разбор строки и обход множеством в
+каждом трайле (прежний .apply) против count_regressive_saccades из
+fixation_sequences
+
+Синтетические последовательности INTEREST_AREA_FIXATION_SEQUENCE в
+формате отчета Data Viewer: трайлы по ~120 фиксаций на текстах из
+~100 слов, чтение слева направо с редкими возвратами и фиксациями вне
+зон (0). Для каждого размера сравниваются время и совпадение
+результатов.
+
+Использование:
+    python eyetracking/benchmark_regressions.py
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from fixation_sequences import count_regressive_saccades
+
+TRIAL_COUNTS = [1_000, 10_000, 50_000]
+WORDS_PER_TEXT = 100
+FIXATIONS_PER_TRIAL = 120
+REPEATS = 3
+
+
+def make_sequences(n_trials, seed=0):
+    """Строки последовательностей: шаг вперед, возврат или фиксация вне зон"""
+    rng = np.random.default_rng(seed)
+    sequences = []
+    for _ in range(n_trials):
+        steps = rng.choice([1, 0, -3], size=FIXATIONS_PER_TRIAL, p=[0.8, 0.1, 0.1])
+        words = np.clip(np.cumsum(steps) + 1, 1, WORDS_PER_TEXT)
+        words[rng.random(FIXATIONS_PER_TRIAL) < 0.05] = 0
+        sequences.append("[" + ", ".join(map(str, words)) + "]")
+    return pd.Series(sequences)
+
+
+def count_row(sequence_data):
+    """Прежний способ для одной строки таблицы"""
+    if pd.isna(sequence_data) or sequence_data == "." or sequence_data == "":
+        return 0
+    sequence_str = str(sequence_data).strip("[]")
+    sequence = [int(x.strip()) for x in sequence_str.split(",") if x.strip().isdigit()]
+    regressive_count = 0
+    visited_positions = set()
+    for current_word in sequence:
+        if current_word == 0:
+            continue
+        if current_word in visited_positions:
+            regressive_count += 1
+        else:
+            visited_positions.add(current_word)
+    return regressive_count
+
+
+def measure(func, *args):
+    """Лучшее время из REPEATS запусков и результат"""
+    best = np.inf
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    print(f"Трайлы по {FIXATIONS_PER_TRIAL} фиксаций, лучшее из {REPEATS}\n")
+    for n_trials in TRIAL_COUNTS:
+        sequences = make_sequences(n_trials)
+        apply_sec, expected = measure(sequences.apply, count_row)
+        csr_sec, got = measure(count_regressive_saccades, sequences)
+        same = np.array_equal(expected.to_numpy(), got)
+        print(f"{n_trials} трайлов ({n_trials * FIXATIONS_PER_TRIAL} фиксаций):")
+        print(f"  построчный .apply: {apply_sec * 1000:9.1f} мс")
+        print(f"  CSR-массивы:       {csr_sec * 1000:9.1f} мс")
+        print(f"  результаты совпадают: {same}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,9 +6,15 @@ from scipy.stats import (
     mannwhitneyu,
 )
 import os
+import pathlib
+import sys
 import warnings
 import argparse
 
+# Общие модули айтрекинга лежат в папке eyetracking
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from dataviewer_io import EVENTS_AVG_NUMERIC_COLUMNS, IA_AVG_NUMERIC_COLUMNS, load_report
+
 # =============================================================================
 # КОНФИГУРАЦИЯ И КОНСТАНТЫ
 # =============================================================================
@@ -317,7 +323,8 @@ def load_comprehensive_data():
 
     # 1. ДАННЫЕ НА УРОВНЕ СЛОВ
     print("📖 Загрузка данных на уровне слов...")
-    word_data = pd.read_csv(WORD_DATA_FILE, sep="\t", encoding="utf-16", skiprows=1)
+    # Числовые колонки (десятичная запятая) разбираются при чтении
+    word_data = load_report(WORD_DATA_FILE, IA_AVG_NUMERIC_COLUMNS)
     col_names = list(word_data.columns)
 
     # Создаем группировку по условиям для данных слов
@@ -359,13 +366,6 @@ def load_comprehensive_data():
         "IA_RUN_COUNT",
     ]
 
-    # Преобразование данных слов
-    for col in word_numeric_cols:
-        if col in word_data.columns:
-            word_data[col] = pd.to_numeric(
-                word_data[col].astype(str).str.replace(",", "."), errors="coerce"
-            )
-
     # Создаем короткие названия для слов
     for i, col in enumerate(word_numeric_cols):
         if col in word_data.columns and i < len(word_short_names):
@@ -385,16 +385,7 @@ def load_comprehensive_data():
 
     # 2. ДАННЫЕ НА УРОВНЕ ТРАЙЛОВ
     print("📊 Загрузка данных на уровне трайлов...")
-    trial_data = pd.read_csv(TRIAL_DATA_FILE, sep="\t", encoding="utf-16", header=0)
-
-    # Удаляем строку с описаниями и берем только данные
-    trial_data = trial_data.iloc[1:].reset_index(drop=True)
-
-    # Преобразуем запятые в точки и конвертируем в числа
-    for col in trial_data.columns:
-        trial_data[col] = pd.to_numeric(
-            trial_data[col].astype(str).str.replace(",", "."), errors="coerce"
-        )
+    trial_data = load_report(TRIAL_DATA_FILE, EVENTS_AVG_NUMERIC_COLUMNS)
 
     # Добавляем информацию о трайлах
     trial_data["trial"] = range(1, len(trial_data) + 1)
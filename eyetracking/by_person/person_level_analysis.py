@@ -1,4 +1,3 @@
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.stats import (
@@ -6,9 +5,15 @@ from scipy.stats import (
     mannwhitneyu,
 )
 import pathlib
+import sys
 import warnings
 import argparse
 
+# Общие модули айтрекинга лежат в папке eyetracking
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from dataviewer_io import TRIAL_NUMERIC_COLUMNS, load_report
+from fixation_sequences import load_fixation_sequences
+
 # =============================================================================
 # КОНФИГУРАЦИЯ И КОНСТАНТЫ
 # =============================================================================
@@ -119,6 +124,11 @@ UNITS = {
     "REGRESSIVE_SACCADES_PER_WORD": "ед/слово",
     "REGRESSIVE_SACCADES_PER_SECOND": "ед/с",
     "REGRESSIVE_SACCADES_PERCENT": "%",
+    
+    # Показатели первого прохода
+    "FIRST_PASS_READING_TIME": "мс",
+    "REGRESSION_PATH_DURATION": "мс",
+    "FIRST_PASS_SKIP_PERCENT": "%",
 }
 
 # =============================================================================
@@ -219,91 +229,17 @@ def interpret_effect_size_with_warnings(cohens_d, p_value, n_total, variable_nam
     return interpretation
 
 
-def count_regressive_saccades(sequence_data):
-    """
-    Подсчитывает количество возвратных саккад в последовательности фиксаций.
-    
-    Возвратная саккада - это когда участник возвращается к ранее посещенной области интереса.
-    Например, в последовательности [1, 2, 3, 2, 4, 5, 3] есть 2 возвратные саккады:
-    - возврат к 2 (после посещения 3)
-    - возврат к 3 (после посещения 5)
-    
-    Args:
-        sequence_data: Данные последовательности (может быть строкой, списком или NaN)
-        
-    Returns:
-        int: Количество возвратных саккад
-    """
-    if pd.isna(sequence_data) or sequence_data == '.' or sequence_data == '':
-        return 0
-    
-    try:
-        # Если это уже список, используем его
-        if isinstance(sequence_data, list):
-            sequence = sequence_data
-        else:
-            # Если это строка, пытаемся преобразовать в список
-            # Убираем квадратные скобки и разделяем по запятым
-            sequence_str = str(sequence_data).strip('[]')
-            sequence = [int(x.strip()) for x in sequence_str.split(',') if x.strip().isdigit()]
-        
-        if len(sequence) < 2:
-            return 0
-        
-        regressive_count = 0
-        visited_positions = set()
-        
-        for i, current_word in enumerate(sequence):
-            # Пропускаем 0 (означает, что взгляд был между словами)
-            if current_word == 0:
-                continue
-                
-            # Если текущее слово уже было посещено ранее, это возвратная саккада
-            if current_word in visited_positions:
-                regressive_count += 1
-            else:
-                # Добавляем текущее слово в множество посещенных
-                visited_positions.add(current_word)
-        
-        return regressive_count
-        
-    except (ValueError, AttributeError, TypeError):
-        # Если не удается обработать последовательность, возвращаем 0
-        return 0
-
-
 def load_person_data():
     """Загружает данные по людям"""
     print("📂 ЗАГРУЗКА ДАННЫХ ПО ЛЮДЯМ...")
     
-    # Читаем данные как в существующем файле - header=0 и пропускаем вторую строку
-    data = pd.read_csv(DATA_FILE, sep="\t", encoding="utf-16", header=0)
-    
-    # Удаляем строку с описаниями и берем только данные (как в существующем файле)
-    data = data.iloc[1:].reset_index(drop=True)
+    # Числовые колонки (десятичная запятая) разбираются при чтении,
+    # повторные запуски читают готовый снимок таблицы
+    data = load_report(DATA_FILE, TRIAL_NUMERIC_COLUMNS)
     
     print(f"   • Загружено строк: {len(data)}")
     print(f"   • Количество колонок: {len(data.columns)}")
     
-    # Преобразуем запятые в точки и конвертируем в числа только для числовых колонок
-    numeric_columns = [
-        'AVERAGE_BLINK_DURATION', 'BLINK_COUNT', 'AVERAGE_FIXATION_DURATION',
-        'MEDIAN_FIXATION_DURATION', 'SD_FIXATION_DURATION', 'FIXATION_DURATION_MAX',
-        'FIXATION_DURATION_MIN', 'FIXATION_COUNT', 'AVERAGE_SACCADE_AMPLITUDE',
-        'MEDIAN_SACCADE_AMPLITUDE', 'SD_SACCADE_AMPLITUDE', 'SACCADE_COUNT',
-        'DURATION', 'PUPIL_SIZE_MAX', 'PUPIL_SIZE_MEAN', 'PUPIL_SIZE_MIN',
-        'VISITED_INTEREST_AREA_COUNT', 'IA_COUNT', 'RUN_COUNT', 'SAMPLE_COUNT'
-    ]
-    
-    for col in numeric_columns:
-        if col in data.columns:
-            data[col] = pd.to_numeric(
-                data[col].astype(str).str.replace(",", "."), errors="coerce"
-            )
-    
-    # Преобразуем INDEX в числовой
-    data['INDEX'] = pd.to_numeric(data['INDEX'], errors='coerce')
-    
     # Создаем нормализованные метрики (как в существующем файле)
     print("   • Создание нормализованных метрик...")
     
@@ -339,7 +275,9 @@ def load_person_data():
     
     # 11. Анализ возвратных саккад
     print("   • Анализ возвратных саккад...")
-    data['REGRESSIVE_SACCADES'] = data['INTEREST_AREA_FIXATION_SEQUENCE'].apply(count_regressive_saccades)
+    # Последовательности визитов зон разбираются один раз (и кэшируются)
+    sequences = load_fixation_sequences(DATA_FILE, data)
+    data['REGRESSIVE_SACCADES'] = sequences.regressive_saccades()
     
     # 12. Количество возвратных саккад на слово
     data['REGRESSIVE_SACCADES_PER_WORD'] = data['REGRESSIVE_SACCADES'] / data['IA_COUNT']
@@ -350,6 +288,12 @@ def load_person_data():
     # 14. Процент возвратных саккад от общего количества саккад
     data['REGRESSIVE_SACCADES_PERCENT'] = (data['REGRESSIVE_SACCADES'] / data['SACCADE_COUNT']) * 100
     
+    # 15. Показатели первого прохода по словам: среднее время первого прохода,
+    # средняя длительность пути регрессии и процент пропущенных слов
+    reading = sequences.trial_reading_measures(data['IA_COUNT'])
+    for col in reading.columns:
+        data[col] = reading[col].to_numpy()
+    
     # Добавляем колонку с условием (стресс/без стресса)
     data['condition'] = data['INDEX'].apply(lambda x: 'stress' if x > STRESS_THRESHOLD else 'no_stress')
     
@@ -416,7 +360,12 @@ def analyze_person_level_differences(data):
         'REGRESSIVE_SACCADES': 'mean',
         'REGRESSIVE_SACCADES_PER_WORD': 'mean',
         'REGRESSIVE_SACCADES_PER_SECOND': 'mean',
-        'REGRESSIVE_SACCADES_PERCENT': 'mean'
+        'REGRESSIVE_SACCADES_PERCENT': 'mean',
+        
+        # Показатели первого прохода
+        'FIRST_PASS_READING_TIME': 'mean',
+        'REGRESSION_PATH_DURATION': 'mean',
+        'FIRST_PASS_SKIP_PERCENT': 'mean'
     }).reset_index()
     
     # Разделяем на группы
@@ -457,7 +406,10 @@ def analyze_person_level_differences(data):
         
         # Возвратные саккады
         'REGRESSIVE_SACCADES', 'REGRESSIVE_SACCADES_PER_WORD', 
-        'REGRESSIVE_SACCADES_PER_SECOND', 'REGRESSIVE_SACCADES_PERCENT'
+        'REGRESSIVE_SACCADES_PER_SECOND', 'REGRESSIVE_SACCADES_PERCENT',
+        
+        # Показатели первого прохода
+        'FIRST_PASS_READING_TIME', 'REGRESSION_PATH_DURATION', 'FIRST_PASS_SKIP_PERCENT'
     ]
     
     for measure in measure_names:
@@ -613,7 +565,10 @@ def create_enhanced_trial_dynamics_visualization(data, key_measures):
         "TEXT_COVERAGE_PERCENT": "Покрытие текста (%)",
         "REVISITED_WORDS_PERCENT": "Повторные слова (%)",
         "REGRESSIVE_SACCADES": "Возвратные саккады",
-        "REGRESSIVE_SACCADES_PERCENT": "Возвратные саккады (%)"
+        "REGRESSIVE_SACCADES_PERCENT": "Возвратные саккады (%)",
+        "FIRST_PASS_READING_TIME": "Время первого прохода",
+        "REGRESSION_PATH_DURATION": "Путь регрессии",
+        "FIRST_PASS_SKIP_PERCENT": "Пропуски при первом проходе (%)"
     }
     
     for i, measure in enumerate(key_measures[:9]):  # Берем первые 9 для красивого расположения
@@ -1103,7 +1058,10 @@ def create_person_visualizations(data, comparison_results, trial_stats):
         'TEXT_COVERAGE_PERCENT', 'REVISITED_WORDS_PERCENT',
         
         # Возвратные саккады
-        'REGRESSIVE_SACCADES', 'REGRESSIVE_SACCADES_PERCENT'
+        'REGRESSIVE_SACCADES', 'REGRESSIVE_SACCADES_PERCENT',
+        
+        # Показатели первого прохода
+        'FIRST_PASS_READING_TIME', 'REGRESSION_PATH_DURATION', 'FIRST_PASS_SKIP_PERCENT'
     ]
     
     for i, measure in enumerate(key_measures):
@@ -0,0 +1,182 @@
+"""
+Чтение отчетов EyeLink Data Viewer
+
+Отчеты Data Viewer (trial.xls, events_avg.xls, ia_avg.xls) - это TSV в
+UTF-16: первая строка - имена столбцов, вторая - их описания, числа
+записаны с десятичной запятой, пропуск обозначается ".". Схема отчета -
+список числовых столбцов: они разбираются сразу при чтении
+(decimal=",", "." -> NaN), остальные столбцы читаются как строки без
+изменений (например, "." в INTEREST_AREA_FIXATION_SEQUENCE сохраняется).
+
+load_report сохраняет разобранную таблицу в снимок
+`<папка отчета>/cache/<имя>.<ключ>.npz` в формате хранилища признаков
+полиграфа (poligraph/feature_store.py: массив на столбец и схема в том
+же архиве, без pickle). Ключ - хэш содержимого отчета и схемы,
+поэтому измененный отчет разбирается заново, а повторные запуски
+читают готовые типизированные столбцы за миллисекунды.
+"""
+
+import hashlib
+import json
+import pathlib
+import sys
+
+import pandas as pd
+
+# Модули полиграфа (хранилище признаков - формат снимков, реестр
+# респондеров) подключаются для всех скриптов айтрекинга только здесь и в
+# конец пути поиска, чтобы не заслонять одноименные модули айтрекинга
+POLIGRAPH_DIR = str(pathlib.Path(__file__).resolve().parent.parent / "poligraph")
+if POLIGRAPH_DIR not in sys.path:
+    sys.path.append(POLIGRAPH_DIR)
+from feature_store import load_table, save_npz, save_table
+
+FORMAT_VERSION = 2
+SNAPSHOT_DIR_NAME = "cache"
+MISSING_VALUES = ["."]
+READ_OPTIONS = {"sep": "\t", "encoding": "utf-16"}
+
+# Отчет по трайлам участников (by_person/data/trial.xls)
+TRIAL_NUMERIC_COLUMNS = [
+    "INDEX",
+    "AVERAGE_BLINK_DURATION",
+    "BLINK_COUNT",
+    "AVERAGE_FIXATION_DURATION",
+    "MEDIAN_FIXATION_DURATION",
+    "SD_FIXATION_DURATION",
+    "FIXATION_DURATION_MAX",
+    "FIXATION_DURATION_MIN",
+    "FIXATION_COUNT",
+    "AVERAGE_SACCADE_AMPLITUDE",
+    "MEDIAN_SACCADE_AMPLITUDE",
+    "SD_SACCADE_AMPLITUDE",
+    "SACCADE_COUNT",
+    "DURATION",
+    "PUPIL_SIZE_MAX",
+    "PUPIL_SIZE_MEAN",
+    "PUPIL_SIZE_MIN",
+    "VISITED_INTEREST_AREA_COUNT",
+    "IA_COUNT",
+    "RUN_COUNT",
+    "SAMPLE_COUNT",
+]
+
+# Усредненный отчет по событиям (by_avg/data/events_avg*.xls)
+EVENTS_AVG_NUMERIC_COLUMNS = [
+    "BLINK_COUNT",
+    "FIXATION_COUNT",
+    "FIXATION_DURATION_MEAN",
+    "FIXATION_DURATION_MEDIAN",
+    "FIXATION_DURATION_SD",
+    "PUPIL_SIZE",
+    "RUN_COUNT",
+    "SACCADE_AMPLITUDE_MEAN",
+    "SACCADE_AMPLITUDE_MEDIAN",
+    "SACCADE_AMPLITUDE_SD",
+    "SACCADE_COUNT",
+    "SAMPLE_COUNT",
+    "TRIAL_DURATION",
+    "INTEREST_AREA_COUNT",
+    "VISITED_INTEREST_AREA_COUNT",
+]
+
+# Усредненный отчет по зонам интереса (by_avg/data/ia_avg*.xls)
+IA_AVG_NUMERIC_COLUMNS = [
+    "TRIAL_GROUP",
+    "IA_ID",
+    "IA_FIRST_FIXATION_DURATION",
+    "IA_FIXATION_COUNT",
+    "IA_FIX_COUNT_%",
+    "IA_DWELL_TIME_%",
+    "IA_DWELL_TIME",
+    "IA_VISITED_TRIAL_%",
+    "IA_REVISIT_TRIAL_%",
+    "IA_RUN_COUNT",
+]
+
+
+def read_report(path, numeric_columns):
+    """Разбор отчета Data Viewer: числовые столбцы - числа, остальные - строки"""
+    columns = pd.read_csv(path, nrows=0, **READ_OPTIONS).columns
+    numeric = [col for col in columns if col in set(numeric_columns)]
+    data = pd.read_csv(
+        path,
+        header=0,
+        skiprows=[1],  # строка с описаниями столбцов
+        decimal=",",
+        dtype={col: str for col in columns if col not in numeric},
+        na_values={col: MISSING_VALUES for col in numeric},
+        float_precision="round_trip",
+        **READ_OPTIONS,
+    )
+    for col in numeric:
+        if not pd.api.types.is_numeric_dtype(data[col].dtype):
+            # Отдельные нечисловые значения -> NaN
+            data[col] = pd.to_numeric(
+                data[col].astype(str).str.replace(",", "."), errors="coerce"
+            )
+    return data
+
+
+def snapshot_key(path, numeric_columns):
+    """Хэш содержимого отчета и его схемы"""
+    digest = hashlib.sha1(f"{FORMAT_VERSION}:{json.dumps(numeric_columns)}".encode())
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def snapshot_path(path, key, kind=""):
+    """Снимок отчета path; kind различает разные снимки одного отчета"""
+    path = pathlib.Path(path)
+    return path.parent / SNAPSHOT_DIR_NAME / f"{path.stem}{kind}.{key}.npz"
+
+
+def remove_stale_snapshots(snapshot):
+    """Удаление прежних снимков того же вида (с другим ключом)"""
+    report_stem = snapshot.name.rsplit(".", 2)[0]
+    for old in snapshot.parent.glob(f"{report_stem}.*.npz"):
+        if old != snapshot:
+            old.unlink(missing_ok=True)
+
+
+def save_snapshot(snapshot, data):
+    """Атомарная запись таблицы в npz; прежние снимки того же отчета удаляются"""
+    save_table(snapshot, data)
+    remove_stale_snapshots(snapshot)
+
+
+def save_snapshot_arrays(snapshot, arrays):
+    """Атомарная запись словаря массивов в npz; прежние снимки того же вида удаляются"""
+    save_npz(snapshot, arrays)
+    remove_stale_snapshots(snapshot)
+
+
+def load_snapshot(snapshot):
+    """DataFrame из снимка"""
+    return load_table(snapshot)
+
+
+def load_report(path, numeric_columns, use_cache=True):
+    """Отчет Data Viewer из снимка, а если его нет - разбором TSV
+
+    Разобранный отчет сохраняется в снимок; если записать снимок не
+    удалось, таблица все равно возвращается.
+    """
+    if not use_cache:
+        return read_report(path, numeric_columns)
+
+    snapshot = snapshot_path(path, snapshot_key(path, numeric_columns))
+    if snapshot.exists():
+        try:
+            return load_snapshot(snapshot)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Снимок {snapshot} поврежден, отчет будет прочитан заново: {e}")
+
+    data = read_report(path, numeric_columns)
+    try:
+        save_snapshot(snapshot, data)
+    except OSError as e:
+        print(f"Не удалось сохранить снимок {snapshot}: {e}")
+    return data
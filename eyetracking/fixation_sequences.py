@@ -0,0 +1,302 @@
+"""
+Последовательности фиксаций по зонам интереса (INTEREST_AREA_FIXATION_SEQUENCE)
+
+В отчете Data Viewer последовательность каждого трайла - строка вида
+"[1, 2, 3, 2, 0, 4]": номера зон интереса (слов) в порядке визитов
+(подряд идущие фиксации в одной зоне - один визит), 0 - визит вне зон;
+INTEREST_AREA_FIXATION_SEQUENCE_DWELL_TIMES - время каждого визита (мс).
+Вместо разбора строки и обхода ее множеством в каждой строке таблицы
+все последовательности разбираются один раз в плоский массив номеров
+зон values и границы трайлов offsets (формат CSR: зоны трайла i -
+values[offsets[i]:offsets[i + 1]]). Метрики трайлов считаются над
+этими массивами целиком.
+
+FixationSequences хранит зоны и времена визитов всех трайлов парами
+(int16/int32 + общие offsets) и считает по ним показатели чтения:
+время первого прохода, длительность пути регрессии и пропуски слов.
+Если в трайле число зон и времен визитов не совпадает, зоны
+сохраняются, а времена визитов трайла считаются отсутствующими.
+load_fixation_sequences кэширует его рядом со снимком отчета.
+"""
+
+import numpy as np
+import pandas as pd
+
+from dataviewer_io import save_snapshot_arrays, snapshot_key, snapshot_path
+
+SEQUENCE_COLUMN = "INTEREST_AREA_FIXATION_SEQUENCE"
+DWELL_COLUMN = "INTEREST_AREA_FIXATION_SEQUENCE_DWELL_TIMES"
+
+
+# Классы байтов строки последовательности
+DIGIT, SEPARATOR, SPACE, OTHER = 0, 1, 2, 3
+BYTE_KIND = np.full(256, OTHER, dtype=np.uint8)
+BYTE_KIND[ord("0") : ord("9") + 1] = DIGIT
+BYTE_KIND[[ord(","), ord("\n")]] = SEPARATOR
+BYTE_KIND[[ord(c) for c in " \t\r\x0b\x0c"]] = SPACE
+
+
+def _neighbor_kind(kind, index, step):
+    """Класс ближайшего не пробельного байта, начиная с index, с шагом step"""
+    index = index.copy()
+    result = kind[index]
+    pending = np.flatnonzero(result == SPACE)
+    while len(pending):
+        index[pending] += step
+        result[pending] = kind[index[pending]]
+        pending = pending[result[pending] == SPACE]
+    return result
+
+
+def parse_sequences(sequences):
+    """Номера зон всех трайлов одним массивом и границы трайлов
+
+    Разбор как у построчного варианта: внешние скобки отбрасываются,
+    элемент между запятыми учитывается, если после удаления пробелов по
+    краям он состоит только из цифр. Пропуск, "." и пустая строка дают
+    пустую последовательность.
+    """
+    text = pd.Series(list(sequences), dtype=object).fillna("").astype(str)
+    text = text.str.strip("[]")
+    # Все трайлы одним буфером байтов, каждый трайл заканчивается "\n"
+    buf = np.frombuffer("\n".join(["", *text, ""]).encode("utf-8"), dtype=np.uint8)
+    kind = BYTE_KIND[buf]
+
+    # Группы подряд идущих цифр (буфер начинается и заканчивается "\n")
+    is_digit = kind == DIGIT
+    edges = np.flatnonzero(is_digit[1:] != is_digit[:-1]) + 1
+    starts, stops = edges[0::2], edges[1::2]
+    # Элемент - число, если слева и справа от группы (через пробелы) разделитель
+    valid = (_neighbor_kind(kind, starts - 1, -1) == SEPARATOR) & (
+        _neighbor_kind(kind, stops, 1) == SEPARATOR
+    )
+    starts, lengths = starts[valid], (stops - starts)[valid]
+
+    # Значения: по одной цифре за шаг, пока не кончатся самые длинные числа
+    values = buf[starts].astype(np.int64) - ord("0")
+    for k in range(1, int(lengths.max(initial=0))):
+        longer = np.flatnonzero(lengths > k)
+        values[longer] = values[longer] * 10 + buf[starts[longer] + k] - ord("0")
+
+    trial_ends = np.flatnonzero(buf == ord("\n"))[1:]
+    offsets = np.concatenate([[0], np.searchsorted(starts, trial_ends)])
+    return values, offsets
+
+
+def trial_ids(offsets):
+    """Номер трайла для каждой фиксации"""
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def revisit_mask(values, offsets):
+    """True для фиксаций на зоне, уже посещенной раньше в том же трайле
+
+    Фиксации вне зон (0) не считаются ни посещением, ни возвратом.
+    """
+    trials = trial_ids(offsets)
+    # Пара (трайл, зона) одним ключом; np.unique дает индекс ее первой фиксации
+    keys = trials * (int(values.max(initial=0)) + 1) + values
+    _, first = np.unique(keys, return_index=True)
+    revisits = values != 0
+    revisits[first] = False
+    return revisits
+
+
+def count_regressive_saccades(sequences):
+    """Число возвратных саккад в каждом трайле
+
+    Возвратная саккада - возврат к ранее посещенной зоне интереса. Например,
+    в последовательности [1, 2, 3, 2, 4, 5, 3] их 2: возврат к 2 (после 3)
+    и к 3 (после 5). Фиксации вне зон (0) пропускаются.
+    """
+    values, offsets = parse_sequences(sequences)
+    revisits = revisit_mask(values, offsets)
+    return np.bincount(trial_ids(offsets)[revisits], minlength=len(offsets) - 1)
+
+
+class FixationSequences:
+    """Визиты зон интереса всех трайлов: зона ia, время dwell (мс), границы offsets
+
+    Визиты трайла i - ia[offsets[i]:offsets[i + 1]] и dwell с теми же
+    индексами. Трайлы нумеруются по порядку строк отчета. dwell_valid[i] -
+    есть ли времена визитов трайла i (без них dwell трайла - нули).
+    """
+
+    def __init__(self, ia, dwell, offsets, dwell_valid):
+        if len(ia) != len(dwell) or offsets[-1] != len(ia):
+            raise ValueError("Зоны, времена визитов и границы трайлов не согласованы")
+        if len(dwell_valid) != len(offsets) - 1:
+            raise ValueError("dwell_valid должен содержать значение для каждого трайла")
+        ia_dtype = np.int16 if ia.max(initial=0) <= np.iinfo(np.int16).max else np.int32
+        self.ia = np.asarray(ia, dtype=ia_dtype)
+        self.dwell = np.asarray(dwell, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.dwell_valid = np.asarray(dwell_valid, dtype=bool)
+
+    @classmethod
+    def from_frame(cls, data):
+        """Разбор столбцов последовательностей отчета по трайлам
+
+        В трайлах, где число зон и времен визитов не совпадает, времена
+        визитов отбрасываются (dwell_valid = False): возвратные саккады
+        по зонам считаются, а времена чтения - NaN.
+        """
+        ia, offsets = parse_sequences(data[SEQUENCE_COLUMN])
+        parsed_dwell, dwell_offsets = parse_sequences(data[DWELL_COLUMN])
+        counts = np.diff(offsets)
+        dwell_counts = np.diff(dwell_offsets)
+        dwell_valid = counts == dwell_counts
+        mismatched = np.flatnonzero(~dwell_valid)
+        if len(mismatched):
+            print(
+                f"Число зон и времен визитов не совпадает в трайлах "
+                f"{mismatched[:10]}: времена визитов этих трайлов не учитываются"
+            )
+        # Времена согласованных трайлов на места их визитов, остальные - 0
+        dwell = np.zeros(len(ia), dtype=np.int64)
+        dwell[np.repeat(dwell_valid, counts)] = parsed_dwell[
+            np.repeat(dwell_valid, dwell_counts)
+        ]
+        return cls(ia, dwell, offsets, dwell_valid)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def trial_ids(self):
+        return trial_ids(self.offsets)
+
+    def regressive_saccades(self):
+        """Число возвратных саккад в каждом трайле (см. count_regressive_saccades)"""
+        revisits = revisit_mask(self.ia.astype(np.int64), self.offsets)
+        return np.bincount(self.trial_ids()[revisits], minlength=len(self))
+
+    def first_pass_mask(self):
+        """True для визитов первого прохода
+
+        Визит - первый проход по зоне, если она правее всех зон, посещенных
+        раньше в этом трайле (слово читается впервые и не было пропущено).
+        """
+        trials = self.trial_ids()
+        # Наибольшая зона с начала трайла: ключи следующего трайла больше
+        # всех ключей предыдущего, поэтому хватает одного накопленного максимума
+        scale = int(self.ia.max(initial=0)) + 1
+        keys = trials * scale + self.ia
+        running = np.maximum.accumulate(keys) - trials * scale
+        previous = np.zeros_like(running)
+        previous[1:] = running[:-1]
+        previous[self.offsets[:-1][np.diff(self.offsets) > 0]] = 0
+        return self.ia > previous
+
+    def reading_measures(self, ia_counts):
+        """Показатели чтения по зонам интереса каждого трайла
+
+        ia_counts - число зон в трайле (IA_COUNT). Строка результата -
+        пара (trial, IA), IA от 1 до ia_counts[trial]:
+        - FIRST_PASS_TIME - время визита первого прохода (мс);
+        - REGRESSION_PATH_DURATION - время от начала визита первого прохода
+          до первого визита зоны правее (возвраты назад и визиты вне зон
+          включаются; для последней прочитанной зоны - до конца трайла);
+        - SKIPPED - у зоны нет визита первого прохода (пропущена или
+          прочитана только при возврате).
+        Для пропущенных зон и трайлов без времен визитов (dwell_valid)
+        времена - NaN.
+        """
+        counts = np.nan_to_num(np.asarray(ia_counts, dtype=float)).astype(np.int64)
+        if len(counts) != len(self):
+            raise ValueError("ia_counts должен содержать число зон для каждого трайла")
+        table_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        trials = self.trial_ids()
+        first_pass = np.flatnonzero(self.first_pass_mask())
+        # Путь регрессии заканчивается на следующем визите первого прохода
+        # (зона правее) или в конце трайла
+        next_first_pass = np.append(first_pass[1:], len(self.ia))
+        ends = np.minimum(next_first_pass, self.offsets[trials[first_pass] + 1])
+        elapsed = np.concatenate([[0], np.cumsum(self.dwell, dtype=np.int64)])
+
+        first_pass_trials = trials[first_pass]
+        ia = self.ia[first_pass].astype(np.int64)
+        inside = ia <= counts[first_pass_trials]
+        rows = table_offsets[first_pass_trials[inside]] + ia[inside] - 1
+
+        skipped = np.ones(table_offsets[-1], dtype=bool)
+        skipped[rows] = False
+        first_pass_time = np.full(table_offsets[-1], np.nan)
+        first_pass_time[rows] = self.dwell[first_pass[inside]]
+        regression_path = np.full(table_offsets[-1], np.nan)
+        regression_path[rows] = (elapsed[ends] - elapsed[first_pass])[inside]
+        table_trials = np.repeat(np.arange(len(self)), counts)
+        no_dwell = ~self.dwell_valid[table_trials]
+        first_pass_time[no_dwell] = np.nan
+        regression_path[no_dwell] = np.nan
+        return pd.DataFrame(
+            {
+                "trial": table_trials,
+                "IA": np.arange(table_offsets[-1]) - table_offsets[table_trials] + 1,
+                "FIRST_PASS_TIME": first_pass_time,
+                "REGRESSION_PATH_DURATION": regression_path,
+                "SKIPPED": skipped,
+            }
+        )
+
+    def trial_reading_measures(self, ia_counts):
+        """Средние показатели чтения трайла (индекс - номер трайла)
+
+        FIRST_PASS_READING_TIME и REGRESSION_PATH_DURATION - средние по
+        прочитанным в первом проходе зонам (мс), FIRST_PASS_SKIP_PERCENT -
+        процент зон текста, пропущенных в первом проходе.
+        """
+        measures = self.reading_measures(ia_counts)
+        by_trial = measures.groupby("trial").agg(
+            FIRST_PASS_READING_TIME=("FIRST_PASS_TIME", "mean"),
+            REGRESSION_PATH_DURATION=("REGRESSION_PATH_DURATION", "mean"),
+            FIRST_PASS_SKIP_PERCENT=("SKIPPED", "mean"),
+        )
+        by_trial["FIRST_PASS_SKIP_PERCENT"] *= 100
+        return by_trial.reindex(pd.RangeIndex(len(self)))
+
+    def save(self, path):
+        """Атомарная запись в npz; прежние снимки того же вида удаляются"""
+        save_snapshot_arrays(
+            path,
+            {
+                "ia": self.ia,
+                "dwell": self.dwell,
+                "offsets": self.offsets,
+                "dwell_valid": self.dwell_valid,
+            },
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as npz:
+            return cls(npz["ia"], npz["dwell"], npz["offsets"], npz["dwell_valid"])
+
+
+def load_fixation_sequences(report_path, data, use_cache=True):
+    """FixationSequences отчета report_path (data - его таблица целиком)
+
+    Разобранные последовательности сохраняются рядом со снимком отчета
+    (`cache/<имя>_fixations.<ключ>.npz`) и при повторных запусках
+    читаются без разбора строк.
+    """
+    if not use_cache:
+        return FixationSequences.from_frame(data)
+
+    key = snapshot_key(report_path, [SEQUENCE_COLUMN, DWELL_COLUMN])
+    path = snapshot_path(report_path, key, kind="_fixations")
+    if path.exists():
+        try:
+            sequences = FixationSequences.load(path)
+            if len(sequences) == len(data):
+                return sequences
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Кэш последовательностей {path} поврежден: {e}")
+
+    sequences = FixationSequences.from_frame(data)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        sequences.save(path)
+    except OSError as e:
+        print(f"Не удалось сохранить последовательности {path}: {e}")
+    return sequences
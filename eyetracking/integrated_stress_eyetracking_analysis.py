@@ -15,6 +15,13 @@ import warnings
 from scipy import stats
 from scipy.stats import ttest_ind, mannwhitneyu
 
+from dataviewer_io import TRIAL_NUMERIC_COLUMNS, load_report
+from fixation_sequences import load_fixation_sequences
+from stress_groups import classify_trials
+
+# Реестр респондеров - модуль полиграфа (путь к нему добавляет dataviewer_io)
+from responder_registry import load_registry, responder_groups
+
 # Настройка matplotlib для русского языка
 plt.rcParams['font.family'] = ['Arial Unicode MS', 'Tahoma', 'sans-serif']
 plt.rcParams['axes.unicode_minus'] = False
@@ -31,29 +38,10 @@ class IntegratedStressEyetrackingAnalyzer:
         self.results_dir = pathlib.Path("eyetracking/stress_integrated_results")
         self.results_dir.mkdir(exist_ok=True)
         
-        # Классификация участников на основе реального анализа стресса из полиграфа
-        self.stress_responders = {
-            # Участники, которые реагировали на стресс (из полиграфа)
-            '1707LTA': {'type': 'strong_responder', 'peak_text': 4, 'description': 'Самая яркая реакция (+31.8%)'},
-            '1807KNV': {'type': 'strong_responder', 'peak_text': 4, 'description': 'Резкий пик в 4-м тексте (+150%)'},
-            '1607KYA': {'type': 'moderate_responder', 'peak_text': 4, 'description': 'Умеренная реакция'},
-            '1807OVA': {'type': 'moderate_responder', 'peak_text': 4, 'description': 'Умеренная реакция'},
-            '1807ZUG': {'type': 'weak_responder', 'peak_text': 5, 'description': 'Слабая реакция'},
-            # Дополнительные участники без данных полиграфа
-            '1807SAV': {'type': 'assumed_responder', 'peak_text': 4, 'description': 'Предполагаемый стресс в 4-м тексте'},
-            '1807KAN': {'type': 'assumed_responder', 'peak_text': 4, 'description': 'Предполагаемый стресс в 4-м тексте'},
-        }
-        
-        self.stress_non_responders = {
-            # Участники, которые НЕ реагировали на стресс (из полиграфа)
-            '1707KAV': {'type': 'strong_non_responder', 'description': 'Сильное снижение стресса (-60%)'},
-            '1807HEE': {'type': 'strong_non_responder', 'description': 'Значительное снижение (-66.7%)'},
-            '1807CAA': {'type': 'paradoxical_non_responder', 'description': 'Неожиданное снижение (-26.1%)'},
-            '1607LVA': {'type': 'stable_non_responder', 'description': 'Стабильный уровень (0%)'},
-            '1907ZSI': {'type': 'stable_non_responder', 'description': 'Стабильный уровень (0%)'},
-            '1707DMA': {'type': 'weak_non_responder', 'description': 'Легкое снижение (-10%)'},
-            '1707SAA': {'type': 'weak_non_responder', 'description': 'Легкое снижение (-9.1%)'},
-        }
+        # Классификация участников по реестру респондеров, построенному по
+        # динамике стресса из полиграфа (poligraph/responder_registry.py)
+        self.stress_registry = load_registry()
+        self.stress_responders, self.stress_non_responders = responder_groups(self.stress_registry)
         
         # Объединяем все классификации
         self.all_participants_stress_data = {**self.stress_responders, **self.stress_non_responders}
@@ -67,31 +55,12 @@ class IntegratedStressEyetrackingAnalyzer:
         """Загружает данные айтрекинга"""
         print("\n📂 ЗАГРУЗКА ДАННЫХ АЙТРЕКИНГА...")
         
-        # Читаем данные аналогично person_level_analysis.py
-        data = pd.read_csv(self.eyetracking_data_path, sep="\t", encoding="utf-16", header=0)
-        data = data.iloc[1:].reset_index(drop=True)  # Удаляем строку с описаниями
+        # Общий загрузчик отчетов Data Viewer (как в person_level_analysis.py)
+        data = load_report(self.eyetracking_data_path, TRIAL_NUMERIC_COLUMNS)
         
         print(f"   • Загружено строк: {len(data)}")
         print(f"   • Количество колонок: {len(data.columns)}")
         
-        # Преобразуем запятые в точки для числовых колонок
-        numeric_columns = [
-            'AVERAGE_BLINK_DURATION', 'BLINK_COUNT', 'AVERAGE_FIXATION_DURATION',
-            'MEDIAN_FIXATION_DURATION', 'SD_FIXATION_DURATION', 'FIXATION_DURATION_MAX',
-            'FIXATION_DURATION_MIN', 'FIXATION_COUNT', 'AVERAGE_SACCADE_AMPLITUDE',
-            'MEDIAN_SACCADE_AMPLITUDE', 'SD_SACCADE_AMPLITUDE', 'SACCADE_COUNT',
-            'DURATION', 'PUPIL_SIZE_MAX', 'PUPIL_SIZE_MEAN', 'PUPIL_SIZE_MIN',
-            'VISITED_INTEREST_AREA_COUNT', 'IA_COUNT', 'RUN_COUNT', 'SAMPLE_COUNT'
-        ]
-        
-        for col in numeric_columns:
-            if col in data.columns:
-                data[col] = pd.to_numeric(
-                    data[col].astype(str).str.replace(",", "."), errors="coerce"
-                )
-        
-        data['INDEX'] = pd.to_numeric(data['INDEX'], errors='coerce')
-        
         # Создаем нормализованные метрики
         print("   • Создание нормализованных метрик...")
         
@@ -120,7 +89,8 @@ class IntegratedStressEyetrackingAnalyzer:
         data['BLINKS_PER_SECOND'] = data['BLINK_COUNT'] / (data['DURATION'] / 1000)
         
         # 8. Анализ возвратных саккад
-        data['REGRESSIVE_SACCADES'] = data['INTEREST_AREA_FIXATION_SEQUENCE'].apply(self._count_regressive_saccades)
+        sequences = load_fixation_sequences(self.eyetracking_data_path, data)
+        data['REGRESSIVE_SACCADES'] = sequences.regressive_saccades()
         data['REGRESSIVE_SACCADES_PER_WORD'] = data['REGRESSIVE_SACCADES'] / data['IA_COUNT']
         data['REGRESSIVE_SACCADES_PER_SECOND'] = data['REGRESSIVE_SACCADES'] / (data['DURATION'] / 1000)
         data['REGRESSIVE_SACCADES_PERCENT'] = (data['REGRESSIVE_SACCADES'] / data['SACCADE_COUNT']) * 100
@@ -136,85 +106,15 @@ class IntegratedStressEyetrackingAnalyzer:
         
         return data
     
-    def _count_regressive_saccades(self, sequence_data):
-        """Подсчитывает количество возвратных саккад"""
-        if pd.isna(sequence_data) or sequence_data == '.' or sequence_data == '':
-            return 0
-        
-        try:
-            if isinstance(sequence_data, list):
-                sequence = sequence_data
-            else:
-                sequence_str = str(sequence_data).strip('[]')
-                sequence = [int(x.strip()) for x in sequence_str.split(',') if x.strip().isdigit()]
-            
-            if len(sequence) < 2:
-                return 0
-            
-            regressive_count = 0
-            visited_positions = set()
-            
-            for current_word in sequence:
-                if current_word == 0:
-                    continue
-                    
-                if current_word in visited_positions:
-                    regressive_count += 1
-                else:
-                    visited_positions.add(current_word)
-            
-            return regressive_count
-            
-        except (ValueError, AttributeError, TypeError):
-            return 0
-    
     def _add_stress_classification(self, data):
         """Добавляет классификацию стресса к данным айтрекинга"""
         
-        def classify_participant_text(row):
-            participant_id = row['RECORDING_SESSION_LABEL']
-            text_index = row['INDEX']
-            
-            if participant_id in self.stress_responders:
-                # Для респондеров: тексты 4-6 считаем стрессовыми
-                if text_index >= 4:
-                    return 'actual_stress'
-                else:
-                    return 'baseline'
-            elif participant_id in self.stress_non_responders:
-                # Для нон-респондеров: все тексты считаем нестрессовыми
-                if text_index >= 4:
-                    return 'intended_stress_no_response'
-                else:
-                    return 'baseline'
-            else:
-                # Для участников без данных о стрессе используем старую классификацию
-                return 'unknown'
-        
-        # Применяем классификацию
-        data['stress_classification'] = data.apply(classify_participant_text, axis=1)
-        
-        # Создаем упрощенную группировку
-        def get_stress_group(row):
-            participant_id = row['RECORDING_SESSION_LABEL']
-            if participant_id in self.stress_responders:
-                return 'stress_responders'
-            elif participant_id in self.stress_non_responders:
-                return 'stress_non_responders'
-            else:
-                return 'unknown'
-        
-        data['stress_group'] = data.apply(get_stress_group, axis=1)
-        
-        # Создаем детальную классификацию типов респондеров
-        def get_responder_type(row):
-            participant_id = row['RECORDING_SESSION_LABEL']
-            if participant_id in self.all_participants_stress_data:
-                return self.all_participants_stress_data[participant_id]['type']
-            else:
-                return 'unknown'
-        
-        data['responder_type'] = data.apply(get_responder_type, axis=1)
+        # Классы всех трайлов считаются векторно по таблице участников:
+        # для респондеров тексты 4-6 - реальный стресс, для нон-респондеров -
+        # стресс без реакции, участники без данных о стрессе - unknown
+        classes = classify_trials(data, self.stress_responders, self.stress_non_responders)
+        for col in ['stress_classification', 'stress_group', 'responder_type']:
+            data[col] = classes[col]
         
         return data
     
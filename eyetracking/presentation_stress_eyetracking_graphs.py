@@ -11,7 +11,6 @@
 - 3 показателя с интересными тенденциями
 """
 
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -19,6 +18,12 @@ import pathlib
 import warnings
 import scipy.stats
 
+from dataviewer_io import TRIAL_NUMERIC_COLUMNS, load_report
+from stress_groups import NON_RESPONDERS, RESPONDERS, UNKNOWN, classify_trials
+
+# Реестр респондеров - модуль полиграфа (путь к нему добавляет dataviewer_io)
+from responder_registry import load_registry, responder_groups
+
 # Настройка matplotlib для русского языка и презентационного качества
 plt.rcParams['font.family'] = ['Arial Unicode MS', 'Tahoma', 'sans-serif']
 plt.rcParams['axes.unicode_minus'] = False
@@ -108,26 +113,11 @@ class PresentationEyetrackingGraphs:
             }
         }
         
-        # Классификация участников на основе реального анализа стресса
-        self.stress_responders = {
-            '1707LTA': 'Самая яркая реакция (+31.8%)',
-            '1807KNV': 'Резкий пик в 4-м тексте (+150%)',
-            '1607KYA': 'Умеренная реакция',
-            '1807OVA': 'Умеренная реакция',
-            '1807ZUG': 'Слабая реакция',
-            '1807SAV': 'Предполагаемый стресс',
-            '1807KAN': 'Предполагаемый стресс',
-        }
-        
-        self.stress_non_responders = {
-            '1707KAV': 'Сильное снижение стресса (-60%)',
-            '1807HEE': 'Значительное снижение (-66.7%)',
-            '1807CAA': 'Неожиданное снижение (-26.1%)',
-            '1607LVA': 'Стабильный уровень (0%)',
-            '1907ZSI': 'Стабильный уровень (0%)',
-            '1707DMA': 'Легкое снижение (-10%)',
-            '1707SAA': 'Легкое снижение (-9.1%)',
-        }
+        # Классификация участников по реестру респондеров из полиграфа
+        # (poligraph/responder_registry.py): ID -> подпись для графиков
+        responders, non_responders = responder_groups(load_registry())
+        self.stress_responders = {pid: info['description'] for pid, info in responders.items()}
+        self.stress_non_responders = {pid: info['description'] for pid, info in non_responders.items()}
         
         # Цвета для графиков
         self.colors = {
@@ -150,26 +140,7 @@ class PresentationEyetrackingGraphs:
         print("\n📂 ПОДГОТОВКА ДАННЫХ...")
         
         # Читаем данные аналогично основному скрипту
-        data = pd.read_csv(self.eyetracking_data_path, sep="\t", encoding="utf-16", header=0)
-        data = data.iloc[1:].reset_index(drop=True)  # Удаляем строку с описаниями
-        
-        # Преобразуем числовые колонки
-        numeric_columns = [
-            'AVERAGE_BLINK_DURATION', 'BLINK_COUNT', 'AVERAGE_FIXATION_DURATION',
-            'MEDIAN_FIXATION_DURATION', 'SD_FIXATION_DURATION', 'FIXATION_DURATION_MAX',
-            'FIXATION_DURATION_MIN', 'FIXATION_COUNT', 'AVERAGE_SACCADE_AMPLITUDE',
-            'MEDIAN_SACCADE_AMPLITUDE', 'SD_SACCADE_AMPLITUDE', 'SACCADE_COUNT',
-            'DURATION', 'PUPIL_SIZE_MAX', 'PUPIL_SIZE_MEAN', 'PUPIL_SIZE_MIN',
-            'VISITED_INTEREST_AREA_COUNT', 'IA_COUNT', 'RUN_COUNT', 'SAMPLE_COUNT'
-        ]
-        
-        for col in numeric_columns:
-            if col in data.columns:
-                data[col] = pd.to_numeric(
-                    data[col].astype(str).str.replace(",", "."), errors="coerce"
-                )
-        
-        data['INDEX'] = pd.to_numeric(data['INDEX'], errors='coerce')
+        data = load_report(self.eyetracking_data_path, TRIAL_NUMERIC_COLUMNS)
         
         # Создаем метрики
         data['FIXATIONS_PER_SECOND'] = data['FIXATION_COUNT'] / (data['DURATION'] / 1000)
@@ -177,18 +148,19 @@ class PresentationEyetrackingGraphs:
         data['TEXT_COVERAGE_PERCENT'] = (data['VISITED_INTEREST_AREA_COUNT'] / data['IA_COUNT']) * 100
         
         # Добавляем классификацию стресса
-        def classify_participant(row):
-            participant_id = row['RECORDING_SESSION_LABEL']
-            text_index = row['INDEX']
-            
-            if participant_id in self.stress_responders:
-                return 'stress_responders' if text_index >= 4 else 'baseline_responders'
-            elif participant_id in self.stress_non_responders:
-                return 'stress_non_responders' if text_index >= 4 else 'baseline_non_responders'
-            else:
-                return 'unknown'
-        
-        data['stress_group'] = data.apply(classify_participant, axis=1)
+        classes = classify_trials(data, self.stress_responders, self.stress_non_responders)
+        stress_phase = classes['stress_phase'].to_numpy()
+        group = classes['stress_group'].to_numpy()
+        data['stress_group'] = np.select(
+            [
+                (group == RESPONDERS) & stress_phase,
+                group == RESPONDERS,
+                (group == NON_RESPONDERS) & stress_phase,
+                group == NON_RESPONDERS,
+            ],
+            ['stress_responders', 'baseline_responders', 'stress_non_responders', 'baseline_non_responders'],
+            default=UNKNOWN,
+        ).astype(object)
         
         print(f"   • Загружено записей: {len(data)}")
         print(f"   • Уникальных участников: {data['RECORDING_SESSION_LABEL'].nunique()}")
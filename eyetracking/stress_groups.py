@@ -0,0 +1,92 @@
+"""
+Классификация трайлов айтрекинга по реакции участника на стресс
+
+Группа участника (респондер / нон-респондер) и тип его реакции зависят
+только от RECORDING_SESSION_LABEL, а фаза - только от номера текста
+(INDEX >= STRESS_TEXT_MIN - стрессовые тексты 4-6). Поэтому вместо
+обхода таблицы по строкам метки сессий один раз переводятся в коды
+категорий таблицы участников, группы и типы берутся из нее по кодам,
+а итоговые классы собираются np.select из группы и маски фазы.
+"""
+
+import numpy as np
+import pandas as pd
+
+STRESS_TEXT_MIN = 4
+
+RESPONDERS = "stress_responders"
+NON_RESPONDERS = "stress_non_responders"
+UNKNOWN = "unknown"
+
+
+def participant_table(responders, non_responders):
+    """Таблица участников (индекс - метка сессии): group и responder_type
+
+    responders и non_responders - словари {метка: сведения}; тип реакции
+    берется из сведений-словаря по ключу 'type'. Если участник есть в
+    обоих словарях, группа - респондеры, а тип - из non_responders (как
+    при объединении {**responders, **non_responders}).
+    """
+    labels = list(dict.fromkeys([*responders, *non_responders]))
+    info = {**responders, **non_responders}
+    return pd.DataFrame(
+        {
+            "group": [
+                RESPONDERS if label in responders else NON_RESPONDERS
+                for label in labels
+            ],
+            "responder_type": [
+                info[label].get("type", UNKNOWN)
+                if isinstance(info[label], dict)
+                else UNKNOWN
+                for label in labels
+            ],
+        },
+        index=pd.Index(labels, name="RECORDING_SESSION_LABEL"),
+    )
+
+
+def _lookup(table, column, codes):
+    """Значения столбца таблицы участников по кодам; код -1 - UNKNOWN"""
+    return np.append(table[column].to_numpy(dtype=object), UNKNOWN)[codes]
+
+
+def classify_trials(data, responders, non_responders):
+    """Классы стресса для каждого трайла за один проход
+
+    Возвращает DataFrame с индексом data:
+    - stress_group - группа участника (stress_responders,
+      stress_non_responders или unknown);
+    - responder_type - тип реакции участника;
+    - stress_phase - текст из стрессовой фазы (INDEX >= STRESS_TEXT_MIN);
+    - stress_classification - actual_stress (респондер в стрессовой
+      фазе), intended_stress_no_response (нон-респондер в стрессовой
+      фазе), baseline (тексты 1-3) или unknown.
+    """
+    table = participant_table(responders, non_responders)
+    codes = pd.Categorical(
+        data["RECORDING_SESSION_LABEL"], categories=table.index
+    ).codes
+    group = _lookup(table, "group", codes)
+    stress_phase = (data["INDEX"] >= STRESS_TEXT_MIN).to_numpy()
+
+    responder = group == RESPONDERS
+    non_responder = group == NON_RESPONDERS
+    classification = np.select(
+        [
+            responder & stress_phase,
+            non_responder & stress_phase,
+            responder | non_responder,
+        ],
+        ["actual_stress", "intended_stress_no_response", "baseline"],
+        default=UNKNOWN,
+    )
+    return pd.DataFrame(
+        {
+            "stress_group": group,
+            "responder_type": _lookup(table, "responder_type", codes),
+            "stress_phase": stress_phase,
+            "stress_classification": classification.astype(object),
+        },
+        index=data.index,
+    )
@@ -0,0 +1,77 @@
+"""
+Бенчмарк ресемплинга каналов: полифазный resample_poly против FFT resample
+
+Синтетические каналы 1 кГц длительностью 60 минут приводятся к samp_freq
+из script_predobrabotka. Для каждого метода измеряются время и пиковая
+память (tracemalloc). Второй канал на 7 отсчетов длиннее - его длина
+содержит большой простой множитель, на котором FFT-ресемплинг деградирует.
+Расхождение методов вне краев отражает разницу антиалиасинговых фильтров
+(и дробную длину у второго канала, которую FFT-метод растягивает).
+tracemalloc учитывает буферы numpy, но не внутренние буферы pocketfft.
+
+Использование:
+    python benchmark_resampling.py
+"""
+
+import time
+import tracemalloc
+
+import numpy as np
+
+from script_predobrabotka import resample_signal, samp_freq
+
+SOURCE_RATE = 1000  # Гц
+DURATION_MIN = 60
+METHODS = ["poly", "fft"]
+
+
+def make_channel(n_samples, fs, seed=0):
+    """Синтетический канал: дыхание + пульс + дрейф + шум"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_samples) / fs
+    return (
+        np.sin(2 * np.pi * 0.25 * t)
+        + 0.5 * np.sin(2 * np.pi * 1.2 * t)
+        + 0.01 * t / 60
+        + 0.05 * rng.standard_normal(n_samples)
+    )
+
+
+def measure(sig, method):
+    """Время (с) и пиковая память (МБ) одного ресемплинга"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    resampled = resample_signal(sig, SOURCE_RATE, samp_freq, method=method)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2**20, resampled
+
+
+def main():
+    n_samples = SOURCE_RATE * 60 * DURATION_MIN
+    cases = {
+        f"{n_samples} отсчетов": n_samples,
+        f"{n_samples + 7} отсчетов (большой простой множитель)": n_samples + 7,
+    }
+
+    print(
+        f"Ресемплинг {SOURCE_RATE} Гц -> {samp_freq} Гц, "
+        f"{DURATION_MIN} мин синтетического сигнала\n"
+    )
+    for case_name, n in cases.items():
+        sig = make_channel(n, SOURCE_RATE)
+        print(f"Канал: {case_name} ({sig.nbytes / 2**20:.1f} МБ)")
+        outputs = {}
+        for method in METHODS:
+            elapsed, peak_mb, outputs[method] = measure(sig, method)
+            print(f"  {method:>4}: {elapsed:8.3f} с, пик памяти {peak_mb:8.1f} МБ")
+
+        # Сравнение вне краев, где оба метода по-разному продолжают сигнал
+        edge = samp_freq * 10
+        diff = np.abs(outputs["poly"] - outputs["fft"])[edge:-edge]
+        print(f"  макс. расхождение poly/fft (без 10 с по краям): {diff.max():.2e}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Бенчмарк времени восстановления SCR: поиск до конца записи против
+ограниченного поиска scr_recovery_times из script_rest_work
+
+Синтетический SCR-сигнал длиной в окно анализа (1120 с, 100 Гц) с частыми
+откликами: быстрый подъем и экспоненциальный спад каждые 1-2 с. Старый
+способ для каждого пика сравнивает весь хвост записи и собирает индексы
+всех отсчетов ниже порога, хотя нужен только первый. Во втором случае
+добавлен восходящий дрейф, из-за которого большинство пиков не
+опускается до половины амплитуды (время восстановления NaN). Пики
+находятся с параметрами analyze_scr, для обоих методов сравниваются
+время и совпадение результатов.
+
+Использование:
+    python benchmark_scr_recovery.py
+"""
+
+import time
+
+import numpy as np
+from scipy.signal import find_peaks
+
+from script_rest_work import scr_recovery_times
+
+SAMPLING_RATE = 100  # Гц
+DURATION_SEC = 1120
+REPEATS = 5
+
+
+def make_scr(n_samples, fs, drift=0.0, seed=0):
+    """Синтетический SCR: отклики каждые 1-2 с + дрейф + шум, z-нормализация"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_samples) / fs
+    sig = np.zeros(n_samples)
+    onset = 0.0
+    while onset < t[-1]:
+        onset += rng.uniform(1.0, 2.0)
+        dt = t - onset
+        rise = np.clip(dt / 0.3, 0, 1)
+        sig += rng.uniform(0.5, 1.5) * rise * np.exp(-np.clip(dt, 0, None) / 0.8)
+    sig += drift * t / t[-1] + 0.01 * rng.standard_normal(n_samples)
+    return (sig - sig.mean()) / sig.std()
+
+
+def recovery_times_scan(signal, peaks, peak_heights, sr):
+    """Прежний способ: для каждого пика np.where по signal[peak:]"""
+    recovery_times = np.full(len(peaks), np.nan)
+    for i, peak in enumerate(peaks):
+        cross_points = np.where(signal[peak:] <= peak_heights[i] * 0.5)[0]
+        if len(cross_points) > 0:
+            recovery_times[i] = cross_points[0] / sr
+    return recovery_times
+
+
+def measure(func, *args):
+    """Лучшее время из REPEATS запусков и результат"""
+    best = np.inf
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    n_samples = SAMPLING_RATE * DURATION_SEC
+    cases = {"без дрейфа": 0.0, "с восходящим дрейфом": 20.0}
+
+    print(f"SCR {DURATION_SEC} с при {SAMPLING_RATE} Гц, лучшее из {REPEATS}\n")
+    for case_name, drift in cases.items():
+        sig = make_scr(n_samples, SAMPLING_RATE, drift=drift)
+        # Те же параметры, что и в analyze_scr по умолчанию
+        peaks, properties = find_peaks(
+            sig, height=0.05, prominence=0.03, distance=SAMPLING_RATE
+        )
+        heights = properties["peak_heights"]
+
+        scan_sec, expected = measure(
+            recovery_times_scan, sig, peaks, heights, SAMPLING_RATE
+        )
+        bounded_sec, got = measure(scr_recovery_times, sig, peaks, heights, SAMPLING_RATE)
+        same = np.array_equal(expected, got, equal_nan=True)
+        print(
+            f"Сигнал {case_name}: пиков {len(peaks)}, "
+            f"без пересечения {int(np.isnan(got).sum())}"
+        )
+        print(f"  поиск до конца записи: {scan_sec * 1000:8.2f} мс")
+        print(f"  ограниченный поиск:    {bounded_sec * 1000:8.2f} мс")
+        print(f"  результаты совпадают: {same}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,9 +12,11 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-import re
 import warnings
 
+from feature_store import load_features
+from participants import ParticipantIndex
+
 warnings.filterwarnings('ignore')
 
 # Настройка matplotlib для русского языка
@@ -23,24 +25,13 @@ plt.rcParams['axes.unicode_minus'] = False
 plt.rcParams['figure.facecolor'] = 'white'
 sns.set_style("whitegrid")
 
-def extract_participant_id(filename):
-    """Извлекает ID участника из имени файла"""
-    pattern = r'(\d{4}[A-Z]{3})_exp1'
-    match = re.search(pattern, filename)
-    if match:
-        return match.group(1)
-    return None
-
 def load_real_data():
     """Загружает реальные данные из эксперимента"""
     data_path = pathlib.Path("poligraph/data")
     
     # Загружаем нормализованные данные
-    normalized_file = data_path / "result" / "Signal_Analysis_Results_Normalized.xlsx"
     try:
-        df = pd.read_excel(normalized_file)
-        df['Participant_ID'] = df['File'].apply(extract_participant_id)
-        df = df[df['Participant_ID'].notna()]
+        df = load_features("signal_features", data_path)
         
         # Конвертируем Label в числовой формат для текстов 1-6
         df['Text_Number'] = pd.to_numeric(df['Label'], errors='coerce')
@@ -71,13 +62,15 @@ def demo_line_length_concept_real_data(df):
     responder_example = '1707LTA'  # Самый яркий респондер
     non_responder_example = '1707KAV'  # Самое сильное снижение
     
+    df_by_participant = ParticipantIndex(df)
+    
     # Данные респондера
-    responder_data = df[df['Participant_ID'] == responder_example]
+    responder_data = df_by_participant.rows(responder_example)
     baseline_resp = responder_data[responder_data['Period'] == 'Базовая линия (1-3)']
     stress_resp = responder_data[responder_data['Period'] == 'Стресс (4-6)']
     
     # Данные нон-респондера
-    non_resp_data = df[df['Participant_ID'] == non_responder_example]
+    non_resp_data = df_by_participant.rows(non_responder_example)
     baseline_non = non_resp_data[non_resp_data['Period'] == 'Базовая линия (1-3)']
     stress_non = non_resp_data[non_resp_data['Period'] == 'Стресс (4-6)']
     
@@ -174,9 +167,10 @@ def demo_zscore_normalization_real_data(df):
     
     # Подготавливаем данные для анализа
     comparison_data = []
+    df_by_participant = ParticipantIndex(df)
     
     for participant in selected_participants:
-        participant_data = df[df['Participant_ID'] == participant]
+        participant_data = df_by_participant.rows(participant)
         
         if not participant_data.empty and 'scr r_Mean_Real' in participant_data.columns:
             # Реальные значения
@@ -4,6 +4,10 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import pathlib
 import warnings
+
+from feature_store import load_features
+from participants import ParticipantIndex
+
 warnings.filterwarnings('ignore')
 
 # Настройка matplotlib для русского языка
@@ -15,10 +19,11 @@ def analyze_stress_responders():
     
     # Загружаем данные из предыдущего анализа
     results_path = pathlib.Path("poligraph/stress_dynamics_results")
+    data_path = pathlib.Path("poligraph/data")
     
     try:
-        stress_by_text = pd.read_excel(results_path / 'detailed_stress_by_text.xlsx')
-        dynamics_summary = pd.read_excel(results_path / 'stress_dynamics_summary.xlsx')
+        stress_by_text = load_features("stress_by_text", data_path)
+        dynamics_summary = load_features("stress_dynamics", data_path)
         
         print("=== ДЕТАЛЬНЫЙ АНАЛИЗ УЧАСТНИКОВ ===\n")
         
@@ -164,10 +169,11 @@ def create_detailed_visualizations(stress_by_text, responders, non_responders, r
     # Выбираем по 3 самых ярких представителя каждой группы
     top_responders = responders.nlargest(3, 'Stress_Change')['Participant_ID'].tolist()
     top_non_responders = non_responders.nsmallest(3, 'Stress_Change')['Participant_ID'].tolist()
+    stress_by_participant = ParticipantIndex(stress_by_text)
     
     plt.subplot(2, 1, 1)
     for participant in top_responders:
-        participant_data = stress_by_text[stress_by_text['Participant_ID'] == participant]
+        participant_data = stress_by_participant.rows(participant)
         plt.plot(participant_data['Text_Number'], participant_data['Stress_Score'], 
                 'o-', linewidth=2, markersize=6, label=participant)
     
@@ -181,7 +187,7 @@ def create_detailed_visualizations(stress_by_text, responders, non_responders, r
     
     plt.subplot(2, 1, 2)
     for participant in top_non_responders:
-        participant_data = stress_by_text[stress_by_text['Participant_ID'] == participant]
+        participant_data = stress_by_participant.rows(participant)
         plt.plot(participant_data['Text_Number'], participant_data['Stress_Score'], 
                 'o-', linewidth=2, markersize=6, label=participant)
     
@@ -201,6 +207,7 @@ def analyze_extreme_cases(stress_by_text, responders, non_responders):
     """Анализирует самых ярких представителей каждой группы"""
     
     print("\n=== АНАЛИЗ ЯРКИХ СЛУЧАЕВ ===")
+    stress_by_participant = ParticipantIndex(stress_by_text)
     
     # Самый яркий респондер
     top_responder = responders.loc[responders['Stress_Change'].idxmax()]
@@ -211,7 +218,7 @@ def analyze_extreme_cases(stress_by_text, responders, non_responders):
     print(f"   Стресс в 4-м тексте: {top_responder['Text4_Stress']:.2f}")
     
     # Детальный профиль по текстам для самого яркого респондера
-    top_resp_profile = stress_by_text[stress_by_text['Participant_ID'] == top_responder['Participant_ID']]
+    top_resp_profile = stress_by_participant.rows(top_responder['Participant_ID'])
     print("   Профиль по текстам:")
     for _, row in top_resp_profile.iterrows():
         text_num = int(row['Text_Number'])
@@ -228,7 +235,7 @@ def analyze_extreme_cases(stress_by_text, responders, non_responders):
     print(f"   Стресс в 4-м тексте: {top_non_responder['Text4_Stress']:.2f}")
     
     # Детальный профиль по текстам для самого яркого нон-респондера
-    top_non_resp_profile = stress_by_text[stress_by_text['Participant_ID'] == top_non_responder['Participant_ID']]
+    top_non_resp_profile = stress_by_participant.rows(top_non_responder['Participant_ID'])
     print("   Профиль по текстам:")
     for _, row in top_non_resp_profile.iterrows():
         text_num = int(row['Text_Number'])
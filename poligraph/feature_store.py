@@ -0,0 +1,224 @@
+"""
+Колоночное хранилище таблиц признаков полиграфа (data/features)
+
+Этапы обработки передают друг другу таблицы признаков:
+Signal_Analysis_Results_Normalized.xlsx (script_work),
+SCR_analysis_results.csv (script_rest_work), таблицы динамики стресса
+(stress_dynamics_analysis). Чтение Excel занимает сотни миллисекунд на
+каждую загрузку, поэтому каждая таблица дополнительно сохраняется в
+`<имя>.npz`: один массив на столбец и схема (имена и типы столбцов,
+число строк) в том же архиве. Такой файл читается за миллисекунды без
+pickle. Excel/CSV остаются отчетами для людей.
+
+load_features - единая точка загрузки: таблица из хранилища, а если ее
+нет или отчет новее (перезаписан вручную или старой версией скрипта) -
+из отчета с обновлением хранилища. Participant_ID добавляется один раз
+при сохранении (categorical, см. participants), строки без ID
+отбрасываются.
+
+Тем же форматом (save_table/load_table, save_npz) сохраняются снимки
+отчетов айтрекинга (eyetracking/dataviewer_io.py).
+"""
+
+import json
+import os
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from participants import extract_participant_ids
+
+FORMAT_VERSION = 2
+STORE_DIR_NAME = "features"
+
+# Отчеты относительно папки poligraph (родителя data)
+REPORTS = {
+    "signal_features": "data/result/Signal_Analysis_Results_Normalized.xlsx",
+    "scr_features": "data/result/SCR_analysis_results.csv",
+    "scr_by_stimulus": "data/result/SCR_by_stimulus_results.csv",
+    "stress_by_text": "stress_dynamics_results/detailed_stress_by_text.xlsx",
+    "stress_dynamics": "stress_dynamics_results/stress_dynamics_summary.xlsx",
+}
+# Параметры CSV-отчетов (для Excel с русской локалью)
+CSV_OPTIONS = {"sep": ";", "decimal": ","}
+
+
+def store_path(name, data_dir):
+    """Файл таблицы name в хранилище папки data_dir"""
+    return pathlib.Path(data_dir) / STORE_DIR_NAME / f"{name}.npz"
+
+
+def report_path(name, data_dir):
+    """Файл отчета (Excel/CSV) таблицы name или None"""
+    if name not in REPORTS:
+        return None
+    return pathlib.Path(data_dir).parent / REPORTS[name]
+
+
+def _encode_column(series):
+    """Массивы столбца для npz и его описание в схеме"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = series.cat.categories
+        return {"codes": series.cat.codes.to_numpy()}, {
+            "kind": "category",
+            "categories": [str(c) for c in categories],
+        }
+    if pd.api.types.is_bool_dtype(series.dtype) and not series.hasnans:
+        return {"values": series.to_numpy(dtype=bool)}, {"kind": "bool"}
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        values = series.to_numpy()
+        if values.dtype.kind not in "iuf":
+            # Nullable Int64/Float64 -> float64 с NaN
+            values = series.to_numpy(dtype="float64", na_value=np.nan)
+        return {"values": values}, {"kind": "numeric"}
+
+    # Строки и смешанные object-столбцы (например, Label из Excel):
+    # коды уникальных значений (-1 - пропуск) и сами значения одним блоком
+    # UTF-8 с границами в символах. Массив фиксированной ширины (dtype "U")
+    # для длинных строк (последовательности фиксаций айтрекинга) занимал
+    # бы и читался бы в разы дольше
+    missing = series.isna().to_numpy()
+    text = series.astype(object).where(~missing, "").astype(str)
+    codes, uniques = pd.factorize(text)
+    codes[missing] = -1
+    lengths = np.fromiter(map(len, uniques), dtype=np.int64, count=len(uniques))
+    arrays = {
+        "codes": codes,
+        "text": np.frombuffer("".join(uniques).encode("utf-8"), dtype=np.uint8),
+        "offsets": np.concatenate([[0], np.cumsum(lengths)]),
+    }
+    return arrays, {"kind": "string"}
+
+
+def _decode_strings(arrays):
+    joined = arrays["text"].tobytes().decode("utf-8")
+    offsets = arrays["offsets"]
+    uniques = [joined[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+    return np.array(uniques + [None], dtype=object)[arrays["codes"]]
+
+
+def _decode_column(arrays, spec):
+    if spec["kind"] == "category":
+        return pd.Categorical.from_codes(arrays["codes"], spec["categories"])
+    if spec["kind"] == "string":
+        # Тип строк выбирает pandas, как при чтении CSV/Excel
+        return pd.Series(_decode_strings(arrays))
+    return arrays["values"]
+
+
+def save_npz(path, arrays):
+    """Атомарная запись словаря массивов в npz (временный файл + замена)"""
+    path = pathlib.Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "wb") as fh:
+            np.savez(fh, **arrays)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def save_table(path, df):
+    """Атомарная запись DataFrame в npz со схемой"""
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    arrays, columns = {}, []
+    for i, name in enumerate(df.columns):
+        column_arrays, spec = _encode_column(df[name])
+        for part, values in column_arrays.items():
+            arrays[f"c{i}_{part}"] = values
+        columns.append({"name": str(name), **spec})
+    schema = {"format_version": FORMAT_VERSION, "n_rows": len(df), "columns": columns}
+    arrays["schema"] = np.array(json.dumps(schema, ensure_ascii=False))
+    save_npz(path, arrays)
+
+
+def read_schema(path):
+    """Схема таблицы без чтения столбцов"""
+    with np.load(path, allow_pickle=False) as npz:
+        return json.loads(str(npz["schema"]))
+
+
+def load_table(path, columns=None):
+    """DataFrame из npz; columns - читать только эти столбцы"""
+    with np.load(path, allow_pickle=False) as npz:
+        schema = json.loads(str(npz["schema"]))
+        if schema.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Неизвестная версия формата {path}")
+        data = {}
+        for i, spec in enumerate(schema["columns"]):
+            if columns is not None and spec["name"] not in columns:
+                continue
+            prefix = f"c{i}_"
+            arrays = {
+                key.removeprefix(prefix): npz[key]
+                for key in npz.files
+                if key.startswith(prefix)
+            }
+            data[spec["name"]] = _decode_column(arrays, spec)
+    return pd.DataFrame(data, index=pd.RangeIndex(schema["n_rows"]))
+
+
+def _read_report(path):
+    if path.suffix == ".csv":
+        return pd.read_csv(path, **CSV_OPTIONS)
+    return pd.read_excel(path)
+
+
+def with_participant_id(df):
+    """Categorical Participant_ID (по столбцу File, если его нет)
+
+    Строки без ID отбрасываются.
+    """
+    if "Participant_ID" not in df.columns and "File" in df.columns:
+        df = df.assign(Participant_ID=extract_participant_ids(df["File"]))
+    if "Participant_ID" in df.columns:
+        df = df[df["Participant_ID"].notna()].reset_index(drop=True)
+        df["Participant_ID"] = df["Participant_ID"].astype("category")
+    return df
+
+
+def save_features(name, df, data_dir):
+    """Сохранение таблицы признаков name в хранилище (с Participant_ID)
+
+    Вызывается после записи отчета, чтобы хранилище было не старше его.
+    Возвращает сохраненную таблицу.
+    """
+    df = with_participant_id(df)
+    save_table(store_path(name, data_dir), df)
+    return df
+
+
+def load_features(name, data_dir, columns=None):
+    """Таблица признаков name с Participant_ID
+
+    Читается из хранилища; если таблицы там нет, она записана в другой
+    версии формата или отчет новее, она загружается из отчета и
+    сохраняется в хранилище. FileNotFoundError, если нет ни того, ни
+    другого.
+    """
+    path = store_path(name, data_dir)
+    report = report_path(name, data_dir)
+    report_exists = report is not None and report.exists()
+    if path.exists() and not (
+        report_exists and report.stat().st_mtime_ns > path.stat().st_mtime_ns
+    ):
+        try:
+            return load_table(path, columns)
+        except (OSError, ValueError, KeyError) as e:
+            if not report_exists:
+                raise
+            print(f"Таблица {name} в хранилище не прочитана, загружается отчет: {e}")
+    if not report_exists:
+        raise FileNotFoundError(f"Таблица {name} не найдена: {path}")
+
+    df = with_participant_id(_read_report(report))
+    try:
+        save_table(path, df)
+    except OSError as e:
+        print(f"Не удалось сохранить таблицу {name} в хранилище: {e}")
+    if columns is not None:
+        df = df[[col for col in df.columns if col in columns]]
+    return df
@@ -0,0 +1,78 @@
+"""
+Реестр участников эксперимента
+
+ID участника (например, 1707LTA) извлекается из имени файла записи
+`<дата>_<ID>_exp1` векторным str.extract по уникальным именам файлов
+вместо построчного re.search. Participant_ID хранится как categorical.
+
+ParticipantIndex один раз упорядочивает строки таблицы по участнику и
+запоминает диапазон строк каждого участника, поэтому выборка данных
+участника - срез по готовому диапазону, а не булева маска по всей
+таблице на каждой итерации цикла по участникам.
+"""
+
+import numpy as np
+import pandas as pd
+
+PARTICIPANT_PATTERN = r"(\d{4}[A-Z]{3})_exp1"
+
+
+def extract_participant_ids(files):
+    """Categorical Participant_ID из имен файлов (NaN, если не по шаблону)
+
+    Индекс результата совпадает с индексом files, если это Series.
+    """
+    files = files if isinstance(files, pd.Series) else pd.Series(files)
+    # Имя файла повторяется в каждой его строке: шаблон применяется
+    # только к уникальным именам, затем ID раскладываются по кодам
+    codes, names = pd.factorize(files.astype(str))
+    ids = pd.Series(names).str.extract(PARTICIPANT_PATTERN, expand=False)
+    id_codes, categories = pd.factorize(ids, sort=True)
+    return pd.Series(
+        pd.Categorical.from_codes(id_codes[codes], categories),
+        index=files.index,
+        name=files.name,
+    )
+
+
+class ParticipantIndex:
+    """Диапазоны строк таблицы df по участникам (столбец column)
+
+    Порядок строк внутри участника сохраняется, строки без ID не
+    попадают в индекс. participants - участники в порядке первого
+    появления в df, как у Series.unique().
+    """
+
+    def __init__(self, df, column="Participant_ID"):
+        ids = pd.Categorical(df[column])
+        codes = ids.codes
+        order = np.argsort(codes, kind="stable")
+        order = order[codes[order] >= 0]
+        sorted_codes = codes[order]
+        all_codes = np.arange(len(ids.categories))
+        starts = np.searchsorted(sorted_codes, all_codes, side="left")
+        stops = np.searchsorted(sorted_codes, all_codes, side="right")
+
+        self.frame = df.iloc[order]
+        self.ranges = {
+            participant: (start, stop)
+            for participant, start, stop in zip(ids.categories, starts, stops)
+            if stop > start
+        }
+        # Первая строка участника в исходном порядке
+        first_rows = {p: order[start] for p, (start, _) in self.ranges.items()}
+        self.participants = sorted(self.ranges, key=first_rows.get)
+
+    def __len__(self):
+        return len(self.participants)
+
+    def __iter__(self):
+        return iter(self.participants)
+
+    def __contains__(self, participant):
+        return participant in self.ranges
+
+    def rows(self, participant):
+        """Строки участника (пустая таблица, если его нет)"""
+        start, stop = self.ranges.get(participant, (0, 0))
+        return self.frame.iloc[start:stop]
@@ -0,0 +1,379 @@
+"""
+Запуск этапов обработки полиграфа с учетом зависимостей
+
+Этапы (скрипты папки poligraph) описаны в STAGES: входы, выходы и
+этапы, после которых этап можно запускать. Входы - данные, сам скрипт,
+его модули и файлы настроек (например, scoring_rules.json), поэтому
+правка порога перезапускает только зависящие от него этапы.
+
+Этап пропускается, если все его выходы на месте, а входы не изменились
+с последнего успешного запуска: список входных файлов с их mtime
+сохраняется в data/cache/pipeline/<этап>.json. Для этапа без такой
+записи (первый запуск раннера) достаточно, чтобы входы были не новее
+выходов. Готовые к запуску независимые этапы (script_work и
+script_rest_work, анализ стресса и анализ динамики) выполняются
+одновременно, вывод каждого пишется в data/cache/pipeline/<этап>.log.
+Если этап завершился с ошибкой, зависящие от него этапы не
+запускаются.
+
+Использование:
+    python poligraph/pipeline.py                 # устаревшие этапы
+    python poligraph/pipeline.py --dry-run       # только показать план
+    python poligraph/pipeline.py --force dynamics
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+POLIGRAPH_DIR = pathlib.Path(__file__).parent.resolve()
+STATE_DIR = POLIGRAPH_DIR / "data/cache/pipeline"
+
+# Общие модули этапов анализа
+ANALYSIS_MODULES = ["feature_store.py", "participants.py"]
+SCORING = ["stress_scoring.py", "scoring_rules.json"]
+
+
+@dataclass
+class Stage:
+    """Этап: скрипт, входы и выходы (glob-шаблоны относительно poligraph)"""
+
+    name: str
+    script: str
+    inputs: list
+    outputs: list
+    after: list = field(default_factory=list)
+
+
+STAGES = [
+    Stage(
+        "preprocess",
+        "script_predobrabotka.py",
+        inputs=[
+            "data/raw_bdf/*.bdf",
+            "script_predobrabotka.py",
+            "preprocess_cache.py",
+            "processed_storage.py",
+        ],
+        outputs=["data/result/*_processed.npy"],
+    ),
+    Stage(
+        "work",
+        "script_work.py",
+        inputs=[
+            "data/result/*_processed.npy",
+            "data/prepared_txt/*.txt",
+            "script_work.py",
+            "stimulus_table.py",
+            "processed_storage.py",
+            *ANALYSIS_MODULES,
+        ],
+        outputs=[
+            "data/result/Signal_Analysis_Results_Normalized.xlsx",
+            "data/features/signal_features.npz",
+        ],
+        after=["preprocess"],
+    ),
+    Stage(
+        "rest_work",
+        "script_rest_work.py",
+        inputs=[
+            "data/result/*_processed.npy",
+            "data/prepared_txt/*.txt",
+            "script_rest_work.py",
+            "stimulus_table.py",
+            "processed_storage.py",
+            *ANALYSIS_MODULES,
+        ],
+        outputs=[
+            "data/result/SCR_analysis_results.csv",
+            "data/features/scr_features.npz",
+        ],
+        after=["preprocess"],
+    ),
+    Stage(
+        "stress_analysis",
+        "run_analysis.py",
+        inputs=[
+            "data/features/signal_features.npz",
+            "data/features/scr_features.npz",
+            "data/spilberg.xlsx",
+            "run_analysis.py",
+            "stress_analysis_script.py",
+            *SCORING,
+            *ANALYSIS_MODULES,
+        ],
+        outputs=["analysis_results/stress_analysis_summary.xlsx"],
+        after=["work", "rest_work"],
+    ),
+    Stage(
+        "dynamics",
+        "stress_dynamics_analysis.py",
+        inputs=[
+            "data/features/signal_features.npz",
+            "data/features/scr_features.npz",
+            "stress_dynamics_analysis.py",
+            *SCORING,
+            *ANALYSIS_MODULES,
+        ],
+        outputs=[
+            "stress_dynamics_results/detailed_stress_by_text.xlsx",
+            "stress_dynamics_results/stress_dynamics_summary.xlsx",
+            "data/features/stress_by_text.npz",
+            "data/features/stress_dynamics.npz",
+        ],
+        after=["work", "rest_work"],
+    ),
+    Stage(
+        "detailed",
+        "detailed_participant_analysis.py",
+        inputs=[
+            "data/features/stress_by_text.npz",
+            "data/features/stress_dynamics.npz",
+            "detailed_participant_analysis.py",
+            *ANALYSIS_MODULES,
+        ],
+        outputs=["stress_dynamics_results/final_experiment_report.xlsx"],
+        after=["dynamics"],
+    ),
+    Stage(
+        "registry",
+        "responder_registry.py",
+        inputs=[
+            "data/features/stress_by_text.npz",
+            "data/features/stress_dynamics.npz",
+            "responder_registry.py",
+            "assumed_responders.json",
+            *SCORING,
+            *ANALYSIS_MODULES,
+        ],
+        outputs=["data/features/responder_registry.npz"],
+        after=["dynamics"],
+    ),
+]
+
+
+def _expand(patterns):
+    """Существующие файлы по glob-шаблонам относительно POLIGRAPH_DIR"""
+    paths = set()
+    for pattern in patterns:
+        paths.update(POLIGRAPH_DIR.glob(pattern))
+    return sorted(paths)
+
+
+def _missing_outputs(stage):
+    """Шаблоны выходов, по которым нет ни одного файла"""
+    return [p for p in stage.outputs if not any(POLIGRAPH_DIR.glob(p))]
+
+
+def input_signature(stage):
+    """Входные файлы этапа и их mtime_ns"""
+    return {
+        str(path.relative_to(POLIGRAPH_DIR)): path.stat().st_mtime_ns
+        for path in _expand(stage.inputs)
+    }
+
+
+def _state_path(stage):
+    return STATE_DIR / f"{stage.name}.json"
+
+
+def _read_state(stage):
+    try:
+        with open(_state_path(stage), encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_state(stage, signature):
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    path = _state_path(stage)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump({"finished": time.time(), "inputs": signature}, fh, indent=2)
+    os.replace(tmp_path, path)
+
+
+def stale_reason(stage):
+    """Причина перезапуска этапа или None, если он актуален"""
+    missing = _missing_outputs(stage)
+    if missing:
+        return f"нет выходов {', '.join(missing)}"
+
+    signature = input_signature(stage)
+    state = _read_state(stage)
+    if state is not None:
+        previous = state.get("inputs", {})
+        changed = [name for name in signature if previous.get(name) != signature[name]]
+        removed = [name for name in previous if name not in signature]
+        if changed or removed:
+            names = changed + removed
+            more = f" и еще {len(names) - 3}" if len(names) > 3 else ""
+            return f"изменились входы: {', '.join(names[:3])}{more}"
+        return None
+
+    # Этап еще не запускался раннером: сравнение времени входов и выходов
+    newest_input = max(signature.values(), default=0)
+    oldest_output = min(path.stat().st_mtime_ns for path in _expand(stage.outputs))
+    if newest_input > oldest_output:
+        return "входы новее выходов"
+    return None
+
+
+def run_stage(stage):
+    """Запуск скрипта этапа; вывод - в лог. Возвращает (код, время)"""
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    env = dict(os.environ)
+    # Пакетный запуск: графики только сохраняются, окна не открываются
+    env.setdefault("MPLBACKEND", "Agg")
+    start = time.perf_counter()
+    signature = input_signature(stage)
+    with open(STATE_DIR / f"{stage.name}.log", "w", encoding="utf-8") as log:
+        result = subprocess.run(
+            [sys.executable, str(POLIGRAPH_DIR / stage.script)],
+            # Скрипты анализа используют пути "poligraph/..." от корня проекта
+            cwd=POLIGRAPH_DIR.parent,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            check=False,
+        )
+    if result.returncode == 0:
+        _write_state(stage, signature)
+    return result.returncode, time.perf_counter() - start
+
+
+def _log_tail(stage, n_lines=20):
+    try:
+        log_text = (STATE_DIR / f"{stage.name}.log").read_text(encoding="utf-8")
+    except OSError:
+        return ""
+    return "\n".join(log_text.splitlines()[-n_lines:])
+
+
+# Статусы этапов после run_pipeline
+SKIPPED, DONE, FAILED, BLOCKED = "пропущен", "выполнен", "ошибка", "не запущен"
+PLANNED = "будет запущен"  # только при dry_run
+
+
+def _launch_reason(stage, status, forced, dry_run):
+    """Причина запуска готового этапа или None, если он актуален"""
+    if stage.name in forced:
+        return "запуск по --force"
+    if dry_run and any(status[dep] == PLANNED for dep in stage.after):
+        # Выходы предыдущих этапов еще не пересчитаны
+        return "будут пересчитаны предыдущие этапы"
+    return stale_reason(stage)
+
+
+def run_pipeline(stages=STAGES, force=(), dry_run=False, workers=None):
+    """Выполнение этапов в порядке зависимостей
+
+    force - имена этапов, которые запускаются без проверки актуальности
+    (зависящие от них этапы увидят новые выходы как измененные входы).
+    Возвращает словарь этап -> статус (SKIPPED, DONE, FAILED, BLOCKED,
+    при dry_run вместо DONE - PLANNED).
+    """
+    by_name = {stage.name: stage for stage in stages}
+    referenced = set(force) | {dep for stage in stages for dep in stage.after}
+    unknown = referenced - set(by_name)
+    if unknown:
+        raise ValueError(f"Неизвестные этапы: {', '.join(sorted(unknown))}")
+
+    status = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers or len(stages)) as pool:
+        while len(status) < len(stages):
+            n_decided = len(status) + len(running)
+            # Этапы, все предшественники которых завершены
+            for stage in stages:
+                if stage.name in status or stage.name in running.values():
+                    continue
+                if not all(dep in status for dep in stage.after):
+                    continue
+                failed = [d for d in stage.after if status[d] in (FAILED, BLOCKED)]
+                if failed:
+                    status[stage.name] = BLOCKED
+                    print(f"[{stage.name}] не запущен: ошибка в {', '.join(failed)}")
+                    continue
+
+                reason = _launch_reason(stage, status, set(force), dry_run)
+                if reason is None:
+                    status[stage.name] = SKIPPED
+                    print(f"[{stage.name}] актуален, пропущен")
+                elif dry_run:
+                    status[stage.name] = PLANNED
+                    print(f"[{stage.name}] будет запущен: {reason}")
+                else:
+                    print(f"[{stage.name}] запуск: {reason}")
+                    running[pool.submit(run_stage, stage)] = stage.name
+
+            if not running:
+                if len(status) + len(running) == n_decided:
+                    raise ValueError("Циклическая зависимость этапов")
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    returncode, seconds = future.result()
+                except OSError as e:
+                    returncode, seconds = None, 0.0
+                    print(f"[{name}] не удалось запустить: {e}")
+                if returncode == 0:
+                    status[name] = DONE
+                    print(f"[{name}] выполнен за {seconds:.1f} с")
+                else:
+                    status[name] = FAILED
+                    print(f"[{name}] ошибка (код {returncode}), конец лога:")
+                    print(_log_tail(by_name[name]))
+    return status
+
+
+def parse_arguments():
+    """Парсинг аргументов командной строки"""
+    parser = argparse.ArgumentParser(
+        description="Запуск этапов обработки полиграфа с учетом зависимостей",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--force",
+        nargs="+",
+        default=[],
+        choices=[stage.name for stage in STAGES],
+        help="Запустить этапы без проверки актуальности",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Показать, какие этапы будут запущены, ничего не выполняя",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Сколько этапов выполнять одновременно (по умолчанию - все готовые)",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    status = run_pipeline(force=args.force, dry_run=args.dry_run, workers=args.workers)
+
+    print("\nИтог:")
+    for name, result in status.items():
+        print(f" - {name}: {result}")
+    if any(result in (FAILED, BLOCKED) for result in status.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Контентно-адресуемый кэш результатов предобработки BDF
+
+Ключ записи - sha256 от содержимого исходного BDF-файла и полной
+конфигурации предобработки (частота, таблицы фильтров, исключаемые
+каналы и т.д.). Поэтому неизмененный файл при тех же параметрах не
+обрабатывается повторно, а изменение любого параметра или самого файла
+дает новый ключ. Запись - пара `<ключ>.npy` + `<ключ>.json` в формате
+processed_storage.
+
+Индекс (index.json в каталоге кэша) хранит для записей размер и время
+последнего использования, а для исходных файлов - их хэш вместе с
+размером и mtime, чтобы не перечитывать неизмененный BDF при каждом
+запуске. При превышении max_bytes удаляются давно не использованные
+записи (LRU).
+
+Кэш не рассчитан на одновременную запись из нескольких процессов:
+preprocess_all обращается к нему только из родительского процесса.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import time
+
+from processed_storage import sidecar_path
+
+INDEX_VERSION = 1
+HASH_BLOCK_BYTES = 1 << 20
+
+
+def _link_or_copy(src, dst):
+    """Атомарная замена dst содержимым src: жесткая ссылка или копия"""
+    dst = pathlib.Path(dst)
+    tmp_path = dst.with_name(f".{dst.name}.{os.getpid()}.tmp")
+    try:
+        try:
+            os.link(src, tmp_path)
+        except OSError:
+            # Другая файловая система или ссылки не поддерживаются
+            shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+class PreprocessCache:
+    """Кэш результатов предобработки в каталоге cache_dir"""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.index_path = self.cache_dir / "index.json"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        empty = {"version": INDEX_VERSION, "entries": {}, "sources": {}}
+        if not self.index_path.exists():
+            return empty
+        try:
+            with open(self.index_path, encoding="utf-8") as fh:
+                index = json.load(fh)
+        except (OSError, ValueError) as e:
+            print(f"Индекс кэша поврежден, кэш начинается заново: {e}")
+            return empty
+        if index.get("version") != INDEX_VERSION:
+            return empty
+        return index
+
+    def _save_index(self):
+        tmp_path = self.index_path.with_name(f".index.json.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(self.index, fh, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def _entry_path(self, key):
+        return self.cache_dir / f"{key}.npy"
+
+    def source_hash(self, path):
+        """sha256 содержимого файла; пересчитывается при смене размера/mtime"""
+        path = pathlib.Path(path).resolve()
+        stat = path.stat()
+        known = self.index["sources"].get(str(path))
+        if (
+            known is not None
+            and known["size"] == stat.st_size
+            and known["mtime_ns"] == stat.st_mtime_ns
+        ):
+            return known["sha256"]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as fh:
+            while block := fh.read(HASH_BLOCK_BYTES):
+                digest.update(block)
+        self.index["sources"][str(path)] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": digest.hexdigest(),
+        }
+        self._save_index()
+        return digest.hexdigest()
+
+    def key(self, path, config):
+        """Ключ записи: хэш файла + конфигурация (словарь, сериализуемый в JSON)"""
+        payload = json.dumps(
+            {"source": self.source_hash(path), "config": config}, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key, output_path):
+        """Выдача записи в output_path (.npy + .json); False при промахе"""
+        entry = self.index["entries"].get(key)
+        npy_path = self._entry_path(key)
+        if entry is None or not npy_path.exists() or not sidecar_path(npy_path).exists():
+            if entry is not None:
+                # Файлы записи удалены вручную
+                del self.index["entries"][key]
+                self._save_index()
+            return False
+
+        # Метаданные раньше массива, как в processed_storage.save_processed
+        _link_or_copy(sidecar_path(npy_path), sidecar_path(output_path))
+        _link_or_copy(npy_path, output_path)
+        entry["last_used"] = time.time()
+        self._save_index()
+        return True
+
+    def put(self, key, output_path, source=None):
+        """Сохранение результата output_path под ключом key с вытеснением"""
+        npy_path = self._entry_path(key)
+        _link_or_copy(sidecar_path(output_path), sidecar_path(npy_path))
+        _link_or_copy(output_path, npy_path)
+        self.index["entries"][key] = {
+            "size": npy_path.stat().st_size + sidecar_path(npy_path).stat().st_size,
+            "last_used": time.time(),
+            "source": str(source) if source is not None else None,
+        }
+        self.evict()
+        self._save_index()
+
+    def discard(self, key):
+        """Удаление записи key (например, поврежденной) из кэша и индекса"""
+        npy_path = self._entry_path(key)
+        for path in (npy_path, sidecar_path(npy_path)):
+            path.unlink(missing_ok=True)
+        if self.index["entries"].pop(key, None) is not None:
+            self._save_index()
+
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self.index["entries"].values())
+
+    def evict(self):
+        """Удаление давно не использованных записей сверх max_bytes"""
+        entries = self.index["entries"]
+        total = self.total_bytes()
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            npy_path = self._entry_path(key)
+            for path in (npy_path, sidecar_path(npy_path)):
+                if path.exists():
+                    path.unlink()
+            total -= entries.pop(key)["size"]
+            print(f"Из кэша вытеснена запись {key[:12]}")
@@ -0,0 +1,146 @@
+"""
+Формат хранения предобработанных сигналов полиграфа
+
+Сигналы файла хранятся как непрерывный 2-D массив (каналы, отсчеты)
+float64/float32 в `<имя>_processed.npy`, а метки каналов и частота
+дискретизации - в JSON-файле рядом (`<имя>_processed.json`). Такой .npy
+открывается через np.load(mmap_mode="r"), поэтому вырезание интервала
+читает с диска только нужные страницы.
+
+Старый формат (pickled dict {"signals", "labels", "sampling_rate"} в
+object-массиве) распознается по заголовку .npy и при первом чтении
+прозрачно конвертируется на месте.
+"""
+
+import json
+import os
+import pathlib
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+
+def sidecar_path(npy_path):
+    """Путь к JSON-файлу с метаданными для .npy"""
+    return pathlib.Path(npy_path).with_suffix(".json")
+
+
+def is_legacy(npy_path):
+    """True, если .npy содержит pickled dict старого формата"""
+    with open(npy_path, "rb") as fh:
+        version = np.lib.format.read_magic(fh)
+        if version == (1, 0):
+            _, _, dtype = np.lib.format.read_array_header_1_0(fh)
+        else:
+            _, _, dtype = np.lib.format.read_array_header_2_0(fh)
+    return dtype.hasobject
+
+
+def _tmp_path(path):
+    """Временный файл рядом с целевым"""
+    path = pathlib.Path(path)
+    return path.with_name(f".{path.name}.{os.getpid()}.tmp")
+
+
+def _replace_atomically(path, write):
+    """Запись во временный файл и атомарная замена целевого"""
+    tmp_path = _tmp_path(path)
+    try:
+        with open(tmp_path, "wb") as fh:
+            write(fh)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def _write_sidecar(npy_path, data, labels, sampling_rate):
+    """Запись JSON с метаданными массива data"""
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "labels": list(labels),
+        "sampling_rate": sampling_rate,
+        "dtype": data.dtype.name,
+        "shape": list(data.shape),
+    }
+    _replace_atomically(
+        sidecar_path(npy_path),
+        lambda fh: fh.write(json.dumps(meta, ensure_ascii=False, indent=2).encode()),
+    )
+
+
+def save_processed(npy_path, signals, labels, sampling_rate, dtype=np.float64):
+    """Сохранение сигналов в memory-mappable формате
+
+    signals - список каналов или 2-D массив; каналы разной длины
+    обрезаются до самого короткого. Метаданные записываются раньше
+    массива, поэтому читатель никогда не видит массив без метаданных.
+    """
+    lengths = [len(chan) for chan in signals]
+    n_samples = min(lengths) if lengths else 0
+    data = np.empty((len(lengths), n_samples), dtype=dtype)
+    for i, chan in enumerate(signals):
+        data[i] = chan[:n_samples]
+
+    _write_sidecar(npy_path, data, labels, sampling_rate)
+    _replace_atomically(npy_path, lambda fh: np.save(fh, data))
+
+
+def create_processed(npy_path, n_channels, n_samples, dtype=np.float64):
+    """Заготовка для потоковой записи: memmap на временном файле
+
+    Каналы пишутся в нее по частям, затем файл публикуется через
+    finalize_processed (или удаляется через discard_processed).
+    """
+    return np.lib.format.open_memmap(
+        _tmp_path(npy_path), mode="w+", dtype=dtype, shape=(n_channels, n_samples)
+    )
+
+
+def finalize_processed(npy_path, data, labels, sampling_rate):
+    """Публикация заготовки create_processed под именем npy_path"""
+    data.flush()
+    _write_sidecar(npy_path, data, labels, sampling_rate)
+    os.replace(data.filename, npy_path)
+
+
+def discard_processed(data):
+    """Удаление незавершенной заготовки create_processed"""
+    tmp_path = pathlib.Path(data.filename)
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+
+def convert_legacy(npy_path):
+    """Конвертация pickled .npy старого формата на месте
+
+    Возвращает (signals, labels, sampling_rate) из старого файла. Если
+    каталог недоступен для записи, файл остается в старом формате.
+    """
+    data = np.load(npy_path, allow_pickle=True).item()
+    signals, labels, sr = data["signals"], data["labels"], data["sampling_rate"]
+    try:
+        save_processed(npy_path, signals, labels, sr)
+        print(f"Конвертирован в новый формат: {pathlib.Path(npy_path).name}")
+    except OSError as e:
+        print(f"Не удалось конвертировать {npy_path}: {e}")
+    return signals, labels, sr
+
+
+def load_processed(npy_path, mmap_mode="r"):
+    """Загрузка предобработанных сигналов: (signals, labels, sampling_rate)
+
+    signals - 2-D массив (каналы, отсчеты), по умолчанию memmap только
+    для чтения. Файлы старого формата сначала конвертируются.
+    """
+    if is_legacy(npy_path):
+        signals, labels, sr = convert_legacy(npy_path)
+        if is_legacy(npy_path):
+            # Конвертация не удалась - работаем с данными в памяти
+            return np.array(signals), labels, sr
+
+    with open(sidecar_path(npy_path), encoding="utf-8") as fh:
+        meta = json.load(fh)
+    signals = np.load(npy_path, mmap_mode=mmap_mode)
+    return signals, meta["labels"], meta["sampling_rate"]
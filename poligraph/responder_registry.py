@@ -0,0 +1,244 @@
+"""
+Реестр респондеров: кто из участников реагировал на индукцию стресса
+
+Реестр строится по таблице динамики стресса (stress_dynamics из
+хранилища признаков, см. StressDynamicsAnalyzer.analyze_stress_dynamics)
+вместо словарей участников в коде анализов:
+- Group - stress_responders (Responded_to_Induction) или
+  stress_non_responders;
+- Responder_Type - сила реакции; пороги - наборы правил responder_type
+  (по Text4_Stress) и non_responder_type (по Stress_Change_Percent) в
+  scoring_rules.json;
+- Peak_Text - текст 4-6 с наибольшим индексом стресса (stress_by_text);
+- Description - подпись для отчетов: тип реакции и признак, по
+  которому он определен (индекс стресса 4-го текста у респондеров,
+  изменение стресса у нон-респондеров).
+Участники без данных полиграфа добавляются из assumed_responders.json
+как предполагаемые респондеры (Assumed).
+
+Реестр сохраняется в хранилище признаков
+(data/features/responder_registry.npz) и строится заново, если таблицы
+динамики, правила или список предполагаемых респондеров новее него.
+Новые участники попадают в реестр после пересчета динамики без правок
+кода.
+
+Использование:
+    python poligraph/responder_registry.py   # пересобрать и показать
+"""
+
+import json
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from feature_store import (
+    load_features,
+    load_table,
+    report_path,
+    save_table,
+    store_path,
+)
+from stress_scoring import RULES_PATH, level, load_rules, score
+
+DATA_DIR = pathlib.Path(__file__).parent / "data"
+ASSUMED_PATH = pathlib.Path(__file__).parent / "assumed_responders.json"
+REGISTRY_NAME = "responder_registry"
+FORMAT_VERSION = 1
+
+RESPONDERS = "stress_responders"
+NON_RESPONDERS = "stress_non_responders"
+ASSUMED_TYPE = "assumed_responder"
+STRESS_TEXTS = [4, 5, 6]
+
+TYPE_DESCRIPTIONS = {
+    "strong_responder": "Сильная реакция",
+    "moderate_responder": "Умеренная реакция",
+    "weak_responder": "Слабая реакция",
+    "strong_non_responder": "Сильное снижение стресса",
+    "paradoxical_non_responder": "Неожиданное снижение",
+    "weak_non_responder": "Легкое снижение",
+    "stable_non_responder": "Стабильный уровень",
+}
+
+
+def load_assumed(path=ASSUMED_PATH):
+    """Предполагаемые респондеры: {ID: {"peak_text", "description"}}"""
+    path = pathlib.Path(path)
+    if not path.exists():
+        return {}
+    with open(path, encoding="utf-8") as fh:
+        config = json.load(fh)
+    if config.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Неизвестная версия списка {path}")
+    return config["participants"]
+
+
+def _peak_texts(stress_by_text, participant_ids):
+    """Текст 4-6 с наибольшим индексом стресса (0 - нет данных)"""
+    scores = stress_by_text.pivot(
+        index="Participant_ID", columns="Text_Number", values="Stress_Score"
+    )
+    scores.index = scores.index.astype(str)
+    values = scores.reindex(index=participant_ids, columns=STRESS_TEXTS)
+    values = values.to_numpy(dtype=float)
+    missing = np.isnan(values)
+    best = np.argmax(np.where(missing, -np.inf, values), axis=1)
+    peak = np.asarray(STRESS_TEXTS)[best]
+    return np.where(missing.all(axis=1), 0, peak)
+
+
+def _describe(responder_type, responded, text4, baseline, change, change_percent):
+    """Подписи участников: тип реакции и признак, по которому он определен
+
+    Тип респондера задается индексом стресса 4-го текста (Text4_Stress),
+    тип нон-респондера - изменением стресса (Stress_Change_Percent).
+    """
+    descriptions = []
+    for kind, is_responder, text4_score, base, delta, percent in zip(
+        responder_type, responded, text4, baseline, change, change_percent
+    ):
+        if is_responder:
+            shift = f"индекс стресса 4-го текста {text4_score:g}"
+        # При нулевой базовой линии процент не определен
+        elif base > 0:
+            shift = f"{percent:+.1f}%" if percent else "0%"
+        else:
+            shift = f"{delta:+.2f} от нулевого уровня"
+        descriptions.append(f"{TYPE_DESCRIPTIONS.get(kind, kind)} ({shift})")
+    return descriptions
+
+
+def build_registry(
+    data_dir=DATA_DIR, rules_path=RULES_PATH, assumed_path=ASSUMED_PATH
+):
+    """Реестр по таблицам динамики стресса и списку предполагаемых респондеров"""
+    dynamics = load_features("stress_dynamics", data_dir)
+    stress_by_text = load_features("stress_by_text", data_dir)
+    rules = load_rules(rules_path)
+
+    participant_ids = dynamics["Participant_ID"].astype(str).to_numpy()
+    responded = dynamics["Responded_to_Induction"].to_numpy(dtype=bool)
+    responder_rules = rules["responder_type"]
+    non_responder_rules = rules["non_responder_type"]
+    responder_type = np.where(
+        responded,
+        level(score(dynamics, responder_rules), responder_rules),
+        level(score(dynamics, non_responder_rules), non_responder_rules),
+    )
+    registry = pd.DataFrame(
+        {
+            "Participant_ID": participant_ids,
+            "Group": np.where(responded, RESPONDERS, NON_RESPONDERS),
+            "Responder_Type": responder_type.astype(str),
+            "Peak_Text": _peak_texts(stress_by_text, participant_ids),
+            "Description": _describe(
+                responder_type,
+                responded,
+                dynamics["Text4_Stress"],
+                dynamics["Baseline_Stress"],
+                dynamics["Stress_Change"],
+                dynamics["Stress_Change_Percent"],
+            ),
+            "Stress_Change": dynamics["Stress_Change"].to_numpy(float),
+            "Stress_Change_Percent": dynamics["Stress_Change_Percent"].to_numpy(float),
+            "Text4_Stress": dynamics["Text4_Stress"].to_numpy(float),
+            "Assumed": False,
+        }
+    )
+
+    # Участники с данными полиграфа классифицируются по ним
+    assumed = {
+        participant: info
+        for participant, info in load_assumed(assumed_path).items()
+        if participant not in set(participant_ids)
+    }
+    if assumed:
+        assumed_rows = pd.DataFrame(
+            {
+                "Participant_ID": list(assumed),
+                "Group": RESPONDERS,
+                "Responder_Type": ASSUMED_TYPE,
+                "Peak_Text": [
+                    int(info.get("peak_text", 0)) for info in assumed.values()
+                ],
+                "Description": [info["description"] for info in assumed.values()],
+                "Stress_Change": np.nan,
+                "Stress_Change_Percent": np.nan,
+                "Text4_Stress": np.nan,
+                "Assumed": True,
+            }
+        )
+        registry = pd.concat([registry, assumed_rows], ignore_index=True)
+    return registry
+
+
+def _sources(data_dir, rules_path, assumed_path):
+    """Файлы, от которых зависит реестр"""
+    sources = [pathlib.Path(__file__), pathlib.Path(rules_path)]
+    sources.append(pathlib.Path(assumed_path))
+    for name in ("stress_dynamics", "stress_by_text"):
+        sources += [store_path(name, data_dir), report_path(name, data_dir)]
+    return [path for path in sources if path.exists()]
+
+
+def load_registry(
+    data_dir=DATA_DIR, rules_path=RULES_PATH, assumed_path=ASSUMED_PATH
+):
+    """Реестр из хранилища, а если он устарел - построенный заново"""
+    path = store_path(REGISTRY_NAME, data_dir)
+    if path.exists():
+        built = path.stat().st_mtime_ns
+        sources = _sources(data_dir, rules_path, assumed_path)
+        if all(source.stat().st_mtime_ns <= built for source in sources):
+            try:
+                return load_table(path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Реестр {path} поврежден, он будет построен заново: {e}")
+
+    registry = build_registry(data_dir, rules_path, assumed_path)
+    try:
+        save_table(path, registry)
+    except OSError as e:
+        print(f"Не удалось сохранить реестр {path}: {e}")
+    return registry
+
+
+def responder_groups(registry):
+    """Словари респондеров и нон-респондеров
+
+    {ID: {"type", "peak_text", "description"}} - в формате прежних словарей
+    участников анализов айтрекинга.
+    """
+    groups = {RESPONDERS: {}, NON_RESPONDERS: {}}
+    for row in registry.itertuples(index=False):
+        groups[row.Group][row.Participant_ID] = {
+            "type": row.Responder_Type,
+            "peak_text": int(row.Peak_Text),
+            "description": row.Description,
+        }
+    return groups[RESPONDERS], groups[NON_RESPONDERS]
+
+
+def responder_ids(registry, assumed=False):
+    """ID респондеров; предполагаемые - только при assumed=True"""
+    responders = registry["Group"] == RESPONDERS
+    if not assumed:
+        responders &= ~registry["Assumed"].astype(bool)
+    return registry.loc[responders, "Participant_ID"].tolist()
+
+
+def main():
+    registry = build_registry()
+    path = store_path(REGISTRY_NAME, DATA_DIR)
+    save_table(path, registry)
+
+    columns = ["Participant_ID", "Group", "Responder_Type", "Peak_Text", "Description"]
+    print(registry[columns].to_string(index=False))
+    responders = (registry["Group"] == RESPONDERS).sum()
+    print(f"\nРеспондеров: {responders}, нон-респондеров: {len(registry) - responders}")
+    print(f"Реестр сохранен: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,24 @@
+import json
+import os
 import pathlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from scipy.signal import find_peaks
-from scipy.stats import skew, kurtosis
+
+from feature_store import CSV_OPTIONS, save_features
+from processed_storage import load_processed
+from stimulus_table import load_stimuli
+
+
+STAT_COLUMNS = ["Raw-SD", "Norm-SD", "RMSSD", "Skewness", "Kurtosis", "Fano-Factor"]
 
 
 def load_data(file_path):
-    """Загрузка данных из .npy файла"""
-    data = np.load(file_path, allow_pickle=True).item()
-    return data["signals"], data["labels"], data["sampling_rate"]
+    """Загрузка данных из .npy файла (memmap, только для чтения)"""
+    return load_processed(file_path)
 
 
 def normalize_data(signals):
@@ -17,8 +26,87 @@ def normalize_data(signals):
     return [(channel - np.mean(channel)) / np.std(channel) for channel in signals]
 
 
-def analyze_scr(signal, sr, peak_height=0.05, peak_prominence=0.03, min_distance=1.0):
-    """Анализ SCR характеристик для одного канала с возвратом позиций пиков"""
+def first_crossing_at_or_below(signal, starts, thresholds, block=128):
+    """Для каждой пары (start, threshold) первый индекс j >= start, где
+    signal[j] <= threshold (-1, если такого нет)
+
+    Поиск ограничен и не доходит до конца записи: сигнал делится на блоки
+    по block отсчетов, по минимумам блоков строится разреженная таблица
+    (минимумы отрезков из 2^k блоков). Для всех стартов сразу проверяется
+    остаток своего блока, затем двоичным подъемом по таблице находится
+    первый блок с минимумом <= порога, и внутри него - сам отсчет.
+    Время O(стартов * (block + log n)), память O(n / block * log n).
+    """
+    signal = np.asarray(signal)
+    starts = np.asarray(starts, dtype=np.int64)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    crossings = np.full(len(starts), -1, dtype=np.int64)
+    n = len(signal)
+    if n == 0 or len(starts) == 0:
+        return crossings
+
+    n_blocks = -(-n // block)
+    # NaN, как и +inf, никогда не бывает <= порога
+    padded = np.full(n_blocks * block, np.inf)
+    padded[:n] = np.where(np.isnan(signal), np.inf, signal)
+    blocks = padded.reshape(n_blocks, block)
+    offsets = np.arange(block)
+
+    def scan(rows, block_idx, from_offset):
+        """Первое пересечение внутри блоков block_idx начиная с from_offset"""
+        hit = (blocks[block_idx] <= thresholds[rows, None]) & (
+            offsets >= from_offset[:, None]
+        )
+        found = hit.any(axis=1)
+        crossings[rows[found]] = block_idx[found] * block + hit[found].argmax(axis=1)
+        return rows[~found]
+
+    # Остаток собственного блока
+    rows = np.arange(len(starts))
+    pending = scan(rows, starts // block, starts % block)
+
+    # Первый следующий блок с минимумом <= порога: двоичный подъем,
+    # levels[k][i] = min(block_min[i : i + 2^k])
+    levels = [blocks.min(axis=1)]
+    while 2 ** len(levels) <= n_blocks:
+        prev, half = levels[-1], 2 ** (len(levels) - 1)
+        levels.append(np.minimum(prev[:-half], prev[half:]))
+    block_idx = starts[pending] // block + 1
+    for k in range(len(levels) - 1, -1, -1):
+        level = levels[k]
+        fits = block_idx < len(level)
+        skip = fits & (level[np.minimum(block_idx, len(level) - 1)] > thresholds[pending])
+        block_idx[skip] += 2**k
+
+    found = block_idx < n_blocks
+    scan(pending[found], block_idx[found], np.zeros(found.sum(), dtype=np.int64))
+    return crossings
+
+
+def scr_recovery_times(signal, peaks, peak_heights, sr):
+    """Время восстановления (сек) для каждого пика: от пика до первого
+    отсчета на уровне половины амплитуды или ниже; NaN, если сигнал до
+    конца записи не опустился"""
+    peaks = np.asarray(peaks, dtype=np.int64)
+    crossings = first_crossing_at_or_below(
+        signal, peaks, np.asarray(peak_heights) * 0.5
+    )
+    return np.where(crossings >= 0, (crossings - peaks) / sr, np.nan)
+
+
+def analyze_scr(
+    signal,
+    sr,
+    peak_height=0.05,
+    peak_prominence=0.03,
+    min_distance=1.0,
+    return_recovery_times=False,
+):
+    """Анализ SCR характеристик для одного канала с возвратом позиций пиков
+
+    При return_recovery_times=True пятым элементом возвращается массив
+    времен восстановления по каждому пику (см. scr_recovery_times).
+    """
     peaks, properties = find_peaks(
         signal,
         height=peak_height,
@@ -28,19 +116,155 @@ def analyze_scr(signal, sr, peak_height=0.05, peak_prominence=0.03, min_distance
     ns_scr = len(peaks)
     amp_scr = np.mean(properties["peak_heights"]) if ns_scr > 0 else 0.0
 
-    recovery_times = []
-    for i, peak in enumerate(peaks):
-        half_amp = properties["peak_heights"][i] * 0.5
-        recovery_signal = signal[peak:]
-        cross_points = np.where(recovery_signal <= half_amp)[0]
-        if len(cross_points) > 0:
-            recovery_time = cross_points[0] / sr
-            recovery_times.append(recovery_time)
-
-    avg_recovery = np.mean(recovery_times) if recovery_times else 0.0
+    recovery_times = scr_recovery_times(signal, peaks, properties["peak_heights"], sr)
+    recovered = recovery_times[~np.isnan(recovery_times)]
+    avg_recovery = np.mean(recovered) if len(recovered) else 0.0
+    if return_recovery_times:
+        return ns_scr, amp_scr, avg_recovery, peaks, recovery_times
     return ns_scr, amp_scr, avg_recovery, peaks
 
 
+def channel_stats(original_signal):
+    """Статистики канала за один проход по отклонениям от среднего
+
+    Raw-SD и Fano-Factor - по исходному сигналу, Norm-SD, RMSSD, Skewness
+    и Kurtosis - по z-нормализованному (как normalize_data). Моменты
+    нормализованного сигнала выражаются через центральные моменты
+    исходного, поэтому нормализованная копия не нужна: асимметрия и
+    эксцесс (scipy.stats skew/kurtosis по умолчанию) не меняются при
+    линейном преобразовании, а разности делятся на СКО.
+    """
+    x = np.asarray(original_signal, dtype=np.float64)
+    n = len(x)
+    mean_val = x.mean()
+    dev = x - mean_val
+    dev2 = dev * dev
+    m2 = dev2.mean()
+    var_unbiased = m2 * n / (n - 1)
+    diff = np.diff(x)
+    fano = var_unbiased / mean_val if abs(mean_val) > 1e-7 else np.nan
+
+    if m2 == 0:
+        # Постоянный сигнал: нормализация не определена
+        return {
+            "Raw-SD": 0.0,
+            "Norm-SD": np.nan,
+            "RMSSD": np.nan,
+            "Skewness": np.nan,
+            "Kurtosis": np.nan,
+            "Fano-Factor": fano,
+        }
+    return {
+        "Raw-SD": np.sqrt(var_unbiased),
+        # СКО нормализованного сигнала с ddof=0 равно 1
+        "Norm-SD": np.sqrt(n / (n - 1)),
+        "RMSSD": np.sqrt(np.mean(diff * diff) / m2),
+        "Skewness": (dev2 * dev).mean() / m2**1.5,
+        "Kurtosis": (dev2 * dev2).mean() / m2**2 - 3.0,
+        "Fano-Factor": fano,
+    }
+
+
+def event_locked_scr(
+    signal, sr, start_idx, end_idx, peak_height=0.05, peak_prominence=0.03,
+    min_distance=1.0,
+):
+    """NS-SCR, Amp-SCR и Recovery-Time для каждого интервала [start, end)
+
+    Пики ищутся один раз по всей записи (с параметрами analyze_scr), время
+    восстановления каждого пика - один раз (scr_recovery_times), после чего
+    пики раскладываются по интервалам через searchsorted, а суммы амплитуд
+    и времен восстановления берутся из префиксных сумм. Пик относится к
+    интервалу, в который попадает его вершина; восстановление может
+    заканчиваться после конца интервала. В отличие от find_peaks по
+    вырезанному куску, пики на границах интервала не теряются, а
+    выраженность (prominence) считается по всей записи.
+
+    Возвращает (ns_scr, amp_scr, avg_recovery) - массивы по интервалам;
+    при отсутствии пиков (восстановлений) амплитуда (время) равна 0.0, как
+    в analyze_scr.
+    """
+    peaks, properties = find_peaks(
+        signal,
+        height=peak_height,
+        prominence=peak_prominence,
+        distance=int(sr * min_distance),
+    )
+    heights = properties["peak_heights"]
+    recovery_times = scr_recovery_times(signal, peaks, heights, sr)
+    recovered = ~np.isnan(recovery_times)
+
+    lo = np.searchsorted(peaks, start_idx, side="left")
+    hi = np.searchsorted(peaks, end_idx, side="left")
+
+    def interval_sums(values):
+        sums = np.concatenate([[0.0], np.cumsum(values, dtype=np.float64)])
+        return sums[hi] - sums[lo]
+
+    ns_scr = hi - lo
+    n_recovered = interval_sums(recovered)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        amp_scr = np.where(ns_scr > 0, interval_sums(heights) / ns_scr, 0.0)
+        avg_recovery = np.where(
+            n_recovered > 0,
+            interval_sums(np.where(recovered, recovery_times, 0.0)) / n_recovered,
+            0.0,
+        )
+    return ns_scr, amp_scr, avg_recovery
+
+
+def process_file_events(file_path, log_path, scr_channels=("scr l", "scr r")):
+    """SCR-показатели по каждому стимулу лог-файла для SCR-каналов файла
+
+    Каналы z-нормализуются по всей записи. Возвращает DataFrame со
+    столбцами File, Channel, Label, Start_Time, End_Time, NS-SCR, Amp-SCR,
+    Recovery-Time или None, если стимулов внутри записи нет.
+    """
+    try:
+        signals, labels, sr = load_data(file_path)
+        stimuli = load_stimuli(log_path, sr, npy_path=file_path)
+        if stimuli.empty:
+            print(f"Не найдено интервалов в файле: {log_path}")
+            return None
+
+        start_idx = stimuli["start_idx"].to_numpy()
+        end_idx = stimuli["end_idx"].to_numpy()
+
+        # Интервалы вне записи отбрасываются, как в script_work.process_file:
+        # обрезанное окно дало бы заниженные показатели
+        valid = (start_idx >= 0) & (end_idx <= signals.shape[1]) & (start_idx < end_idx)
+        for row in stimuli[~valid].itertuples(index=False):
+            print(f"Некорректный интервал: {row.label} [{row.start}, {row.end}]")
+        if not valid.any():
+            return None
+        stimuli = stimuli[valid]
+        start_idx, end_idx = start_idx[valid], end_idx[valid]
+        parts = []
+        for i, label in enumerate(labels):
+            if label not in scr_channels:
+                continue
+            chan = normalize_data(np.asarray(signals[i : i + 1]))[0]
+            ns, amp, rt = event_locked_scr(chan, sr, start_idx, end_idx)
+            parts.append(
+                pd.DataFrame(
+                    {
+                        "File": file_key(file_path),
+                        "Channel": label,
+                        "Label": stimuli["label"].astype(object).to_numpy(),
+                        "Start_Time": stimuli["start"].to_numpy(),
+                        "End_Time": stimuli["end"].to_numpy(),
+                        "NS-SCR": ns,
+                        "Amp-SCR": amp,
+                        "Recovery-Time": rt,
+                    }
+                )
+            )
+        return pd.concat(parts, ignore_index=True) if parts else None
+    except Exception as e:
+        print(f"Ошибка обработки {file_path}: {str(e)}")
+        return None
+
+
 def calculate_line_length(signal):
     """Вычисление длины линии как суммы абсолютных разностей между соседними точками"""
     return np.sum(np.abs(np.diff(signal)))
@@ -70,23 +294,11 @@ def plot_peaks(signal, peaks, filename, channel_name, sr, save_dir):
 def process_file(file_path, start_sec, end_sec, selected_channels, save_dir):
     """Обработка одного файла с сохранением графиков только для SCR-каналов"""
     try:
-        data = np.load(file_path, allow_pickle=True).item()
-        signals = np.array(data["signals"])
-        labels = data["labels"]
-        sr = data["sampling_rate"]
-
-        # --- Исключаем каналы, которые были исключены на этапе предобработки ---
-        EXCLUDE_LABELS = [
-            "pneumogram l",
-            "pneumogram h",
-            "scr l",
-            "ppg l",
-        ]
-        channel_indices = [i for i, lbl in enumerate(labels) if lbl not in EXCLUDE_LABELS]
-        signals = signals[channel_indices]
-        labels = [labels[i] for i in channel_indices]
+        signals, labels, sr = load_data(file_path)
 
         # --- Автоматическая корректировка интервала ---
+        # Интервал вырезается до выбора каналов: из memmap читаются
+        # только страницы нужного окна
         signal_len = signals.shape[1]
         start_idx = int(start_sec * sr)
         end_idx = int(end_sec * sr)
@@ -97,6 +309,17 @@ def process_file(file_path, start_sec, end_sec, selected_channels, save_dir):
             end_idx = signal_len
         signals = signals[:, start_idx:end_idx]
 
+        # --- Исключаем каналы, которые были исключены на этапе предобработки ---
+        EXCLUDE_LABELS = [
+            "pneumogram l",
+            "pneumogram h",
+            "scr l",
+            "ppg l",
+        ]
+        channel_indices = [i for i, lbl in enumerate(labels) if lbl not in EXCLUDE_LABELS]
+        signals = signals[channel_indices]
+        labels = [labels[i] for i in channel_indices]
+
         # Выбор каналов (оставляем только те, что в selected_channels, если не 'all')
         if selected_channels != "all":
             channel_indices = [
@@ -122,18 +345,7 @@ def process_file(file_path, start_sec, end_sec, selected_channels, save_dir):
                 ns, amp, rt, peaks = analyze_scr(chan, sr)
 
                 # Дополнительные статистики
-                raw_sd = np.std(original_signal, ddof=1)
-                norm_sd = np.std(chan, ddof=1)
-                diff_signal = np.diff(chan)
-                rmssd = np.sqrt(np.mean(diff_signal**2))
-                sk = skew(chan)
-                kurt_val = kurtosis(chan)
-                mean_val = np.mean(original_signal)
-                fano = (
-                    np.var(original_signal, ddof=1) / mean_val
-                    if abs(mean_val) > 1e-7
-                    else np.nan
-                )
+                stats = channel_stats(original_signal)
 
                 # Сохранение графика пиков
                 base_name = pathlib.Path(file_path).name.replace("_processed.npy", "")
@@ -141,7 +353,7 @@ def process_file(file_path, start_sec, end_sec, selected_channels, save_dir):
             else:
                 # Только длина линии для не-SCR каналов
                 ns, amp, rt = np.nan, np.nan, np.nan
-                raw_sd, norm_sd, rmssd, sk, kurt_val, fano = [np.nan] * 6
+                stats = dict.fromkeys(STAT_COLUMNS, np.nan)
 
             # Сохранение результатов
             results.append(
@@ -151,12 +363,7 @@ def process_file(file_path, start_sec, end_sec, selected_channels, save_dir):
                     "Amp-SCR": amp,
                     "Recovery-Time": rt,
                     "Line-Length": line_length,
-                    "Raw-SD": raw_sd,
-                    "Norm-SD": norm_sd,
-                    "RMSSD": rmssd,
-                    "Skewness": sk,
-                    "Kurtosis": kurt_val,
-                    "Fano-Factor": fano,
+                    **{name: stats[name] for name in STAT_COLUMNS},
                 }
             )
 
@@ -166,6 +373,126 @@ def process_file(file_path, start_sec, end_sec, selected_channels, save_dir):
         return None
 
 
+def file_key(file_path):
+    """Имя записи в столбце File"""
+    return pathlib.Path(file_path).name.replace("_processed.npy", "")
+
+
+def input_signature(file_path):
+    """Размер и mtime файла записи - признак того, что он не пересоздан"""
+    stat = pathlib.Path(file_path).stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _process_file_rows(file_path, start_sec, end_sec, selected_channels, save_dir):
+    """Строки результата одного файла (для пула процессов)"""
+    metrics = process_file(file_path, start_sec, end_sec, selected_channels, save_dir)
+    if not metrics:
+        return None
+    return [{"File": file_key(file_path), **chan_metrics} for chan_metrics in metrics]
+
+
+def process_all(
+    paths, start_sec, end_sec, selected_channels, save_dir, output_path, workers=None
+):
+    """Параллельный анализ файлов с записью результатов по мере готовности
+
+    Файлы распределяются по процессам (workers: None -> os.cpu_count(),
+    1 -> последовательно). Строки каждого готового файла сразу атомарно
+    записываются в отдельный CSV в папке `<output>.partial`; если запуск
+    прервался, повторный запуск пропускает уже записанные файлы. Рядом
+    лежит manifest.json с параметрами анализа и размером/mtime каждого
+    входного файла: при смене параметров промежуточные результаты
+    отбрасываются целиком, а при пересоздании файла записи - только его
+    CSV. В конце результаты файлов из paths собираются по порядку File в
+    output_path, а промежуточная папка удаляется. Возвращает итоговый
+    DataFrame.
+    """
+    paths = [pathlib.Path(p) for p in paths]
+    output_path = pathlib.Path(output_path)
+    partial_dir = output_path.with_name(f"{output_path.stem}.partial")
+    partial_dir.mkdir(exist_ok=True)
+    manifest_path = partial_dir / "manifest.json"
+
+    def write_csv(df, path):
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        df.to_csv(tmp_path, index=False, encoding="utf-8-sig", **CSV_OPTIONS)
+        os.replace(tmp_path, path)
+
+    params = {
+        "start_sec": start_sec,
+        "end_sec": end_sec,
+        "selected_channels": (
+            selected_channels if selected_channels == "all" else list(selected_channels)
+        ),
+    }
+    inputs = {file_key(p): input_signature(p) for p in paths}
+    try:
+        with open(manifest_path, encoding="utf-8") as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        manifest = {}
+    if manifest.get("params") != params:
+        # Прежний запуск с другими параметрами (или без манифеста)
+        stale = list(partial_dir.glob("*.csv"))
+    else:
+        known = manifest.get("inputs", {})
+        stale = [
+            path
+            for path in partial_dir.glob("*.csv")
+            if path.stem in inputs and known.get(path.stem) != inputs[path.stem]
+        ]
+    for path in stale:
+        path.unlink()
+    tmp_path = manifest_path.with_name(f".{manifest_path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump({"params": params, "inputs": inputs}, fh, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+    done = {file_key(p) for p in paths if (partial_dir / f"{file_key(p)}.csv").exists()}
+    if done:
+        print(f"Продолжение прерванного запуска: уже обработано файлов {len(done)}")
+    pending = [p for p in paths if file_key(p) not in done]
+
+    def write_rows(file_path, rows):
+        if rows:
+            write_csv(pd.DataFrame(rows), partial_dir / f"{file_key(file_path)}.csv")
+
+    args = (start_sec, end_sec, selected_channels, save_dir)
+    workers = os.cpu_count() if workers is None else workers
+    workers = max(1, min(workers, len(pending)))
+    if workers == 1:
+        for file_path in pending:
+            write_rows(file_path, _process_file_rows(file_path, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(_process_file_rows, file_path, *args): file_path
+                for file_path in pending
+            }
+            for future in as_completed(futures):
+                file_path = futures[future]
+                try:
+                    write_rows(file_path, future.result())
+                except Exception as e:
+                    # Например, BrokenProcessPool при аварийном завершении воркера
+                    print(f"Ошибка обработки {file_path}: {e}")
+
+    # Только файлы текущего запуска: CSV файлов не из paths не попадают
+    part_paths = [partial_dir / f"{key}.csv" for key in sorted(inputs)]
+    parts = [
+        pd.read_csv(path, encoding="utf-8-sig", **CSV_OPTIONS)
+        for path in part_paths
+        if path.exists()
+    ]
+    df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    write_csv(df, output_path)
+    for path in [*partial_dir.glob("*.csv"), manifest_path]:
+        path.unlink()
+    partial_dir.rmdir()
+    return df
+
+
 def main():
     # Настройки
     current_dir = pathlib.Path(__file__).parent.resolve()
@@ -182,29 +509,41 @@ def main():
         "ppg r",
     ]
 
-    all_results = []
-    for file_path in data_dir.glob("*_processed.npy"):
-        metrics = process_file(
-            file_path, start_sec, end_sec, selected_channels, data_dir
-        )
-
-        if metrics:
-            for chan_metrics in metrics:
-                all_results.append(
-                    {
-                        "File": file_path.name.replace("_processed.npy", ""),
-                        **chan_metrics,
-                    }
-                )
-
-    # Сохранение результатов
-    df = pd.DataFrame(all_results)
+    # Сохранение результатов (по мере обработки файлов)
     output_path = data_dir / "SCR_analysis_results.csv"
-    df.to_csv(str(output_path), index=False, sep=";", decimal=",", encoding="utf-8-sig")
+    df = process_all(
+        sorted(data_dir.glob("*_processed.npy")),
+        start_sec,
+        end_sec,
+        selected_channels,
+        data_dir,
+        output_path,
+    )
+    save_features("scr_features", df, current_dir / "data")
 
     print(f"\nРезультаты анализа ({len(df)} записей):")
     print(df.to_string(index=False))
 
+    # SCR по каждому стимулу (тексту): пики ищутся один раз на запись
+    log_dir = current_dir / "data/prepared_txt/"
+    event_parts = []
+    for file_path in sorted(data_dir.glob("*_processed.npy")):
+        log_path = log_dir / f"{file_key(file_path)}.txt"
+        if not log_path.exists():
+            print(f"Лог-файл не найден: {log_path}")
+            continue
+        events = process_file_events(file_path, log_path)
+        if events is not None:
+            event_parts.append(events)
+    if event_parts:
+        events_df = pd.concat(event_parts, ignore_index=True)
+        events_path = data_dir / "SCR_by_stimulus_results.csv"
+        events_df.to_csv(
+            events_path, index=False, encoding="utf-8-sig", **CSV_OPTIONS
+        )
+        save_features("scr_by_stimulus", events_df, current_dir / "data")
+        print(f"\nSCR по стимулам ({len(events_df)} записей): {events_path}")
+
 
 if __name__ == "__main__":
     main()
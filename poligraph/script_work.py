@@ -1,13 +1,15 @@
 import pathlib
 import numpy as np
 import pandas as pd
-import codecs
+
+from feature_store import save_features
+from processed_storage import load_processed
+from stimulus_table import load_stimuli, parse_marker_log
 
 
 def load_data(file_path):
-    """Загрузка данных из .npy файла"""
-    data = np.load(file_path, allow_pickle=True).item()
-    return data["signals"], data["labels"], data["sampling_rate"]
+    """Загрузка данных из .npy файла (memmap, только для чтения)"""
+    return load_processed(file_path)
 
 
 # Он считывает  файл, .npy, который у вас появился в папке Resulte после предобработки
@@ -23,69 +25,46 @@ def normalize_features(df, feature_columns):
     return df
 
 
-def calculate_line_length(signal):
-    """Вычисление длины линии как суммы абсолютных разностей между соседними точками"""
-    return np.sum(np.abs(np.diff(signal)))
+def interval_features(signals, start_idx, end_idx):
+    """Длина линии и среднее для всех каналов и интервалов сразу
 
+    signals - 2-D массив (каналы, отсчеты), start_idx/end_idx - индексы
+    интервалов [start, end). Префиксные суммы |diff| и сигнала считаются
+    один раз по участку, покрывающему все интервалы, после чего каждый
+    интервал стоит O(1). Возвращает (line_lengths, means) формы
+    (каналы, интервалы).
+    """
+    start_idx = np.asarray(start_idx, dtype=np.int64)
+    end_idx = np.asarray(end_idx, dtype=np.int64)
+    if len(start_idx) == 0:
+        empty = np.empty((signals.shape[0], 0))
+        return empty, empty.copy()
 
-def calculate_mean(signal):
-    """Вычисление среднего значения сигнала"""
-    return np.mean(signal)
+    # Читаем только участок от первого начала до последнего конца
+    lo, hi = start_idx.min(), end_idx.max()
+    span = np.asarray(signals[:, lo:hi], dtype=np.float64)
+    starts, ends = start_idx - lo, end_idx - lo
 
+    # Префиксные суммы с нулем в начале: sum(x[a:b]) = c[b] - c[a]
+    signal_sums = np.zeros((span.shape[0], span.shape[1] + 1))
+    np.cumsum(span, axis=1, out=signal_sums[:, 1:])
+    diff_sums = np.zeros_like(span)
+    np.cumsum(np.abs(np.diff(span, axis=1)), axis=1, out=diff_sums[:, 1:])
 
-def parse_log_file(log_path):
-    """Парсинг лог-файла с метками стимулов"""
-    intervals = []
-    current_start = None
-    current_label = None
+    line_lengths = diff_sums[:, ends - 1] - diff_sums[:, starts]
+    means = (signal_sums[:, ends] - signal_sums[:, starts]) / (ends - starts)
+    return line_lengths, means
 
-    try:
-        # Чтение файла с обработкой BOM
-        with codecs.open(log_path, "r", encoding="utf-8-sig") as f:
-            for line in f:
-                # Удаление BOM и лишних пробелов
-                line = line.strip().replace("\ufeff", "")
-                if not line:
-                    continue
-
-                # Разделение строки с учетом табуляции и пробелов
-                parts = line.split()
-                if len(parts) < 3:
-                    continue
-
-                try:
-                    # Обработка времени и маркера
-                    time = float(parts[0])
-                    marker = int(parts[2])
-
-                    # Обработка метки (может состоять из нескольких слов)
-                    label = " ".join(parts[3:]) if len(parts) > 3 else None
-
-                    if marker == 5:  # Начало стимула
-                        if current_start is not None:
-                            print(
-                                f"Предупреждение: незакрытый интервал для метки '{current_label}'"
-                            )
-                        current_start = time
-                        current_label = label
-                    elif marker == 6 and current_start is not None:  # Конец стимула
-                        intervals.append(
-                            {
-                                "label": current_label,
-                                "start": current_start,
-                                "end": time,
-                            }
-                        )
-                        current_start = None
-                        current_label = None
-                except (ValueError, IndexError) as e:
-                    print(f"Ошибка обработки строки: {line} - {str(e)}")
-                    continue
 
+def parse_log_file(log_path):
+    """Парсинг лог-файла с метками стимулов: список {"label", "start", "end"}"""
+    try:
+        table = parse_marker_log(log_path)
     except Exception as e:
         print(f"Ошибка чтения лог-файла {log_path}: {str(e)}")
-
-    return intervals
+        return []
+    table["label"] = table["label"].astype(object).where(table["label"].notna(), None)
+    return table.to_dict("records")
 
 
 def process_file(file_path, log_path):
@@ -93,57 +72,49 @@ def process_file(file_path, log_path):
     try:
         # Загрузка данных полиграфа
         signals, labels, sr = load_data(file_path)
-        signals = np.array(signals)
 
-        # Парсинг лог-файла
-        intervals = parse_log_file(log_path)
-        if not intervals:
+        # Таблица стимулов (кэшируется рядом с файлом сигналов)
+        stimuli = load_stimuli(log_path, sr, npy_path=file_path)
+        if stimuli.empty:
             print(f"Не найдено интервалов в файле: {log_path}")
             return None
 
-        # Обработка каждого интервала
-        results = []
         base_name = pathlib.Path(file_path).name.replace("_processed.npy", "")
-
-        for interval in intervals:
-            start_idx = int(interval["start"] * sr)
-            end_idx = int(interval["end"] * sr)
-
-            # Проверка корректности интервала
-            if start_idx < 0 or end_idx > signals.shape[1] or start_idx >= end_idx:
-                print(f"Некорректный интервал: {interval}")
-                continue
-
-            # Вырезаем интервал
-            interval_signals = signals[:, start_idx:end_idx]
-
-            # ВЫЧИСЛЕНИЕ ПАРАМЕТРОВ НА ИСХОДНЫХ СИГНАЛАХ (без нормализации)
-            line_lengths_real = [calculate_line_length(chan) for chan in interval_signals]
-            mean_values_real = [calculate_mean(chan) for chan in interval_signals]
-
-            # Собираем результаты
-            result = {
-                "File": base_name,
-                "Label": interval["label"],
-                "Start_Time": interval["start"],
-                "End_Time": interval["end"],
-                "Duration": interval["end"] - interval["start"],
-            }
-
-            # Добавляем реальные характеристики для каждого канала
-            for i, label in enumerate(labels):
-                result[f"{label}_Line_Length_Real"] = line_lengths_real[i]
-                result[f"{label}_Mean_Real"] = mean_values_real[i]
-
-            # Добавляем нормализованные характеристики (заполним позже)
-            # (Пока просто копируем реальные значения, нормализация будет после)
-            for i, label in enumerate(labels):
-                result[f"{label}_Line_Length"] = line_lengths_real[i]
-                result[f"{label}_Mean"] = mean_values_real[i]
-
-            results.append(result)
-
-        return results
+        start_idx = stimuli["start_idx"].to_numpy()
+        end_idx = stimuli["end_idx"].to_numpy()
+
+        # Проверка корректности интервалов
+        valid = (start_idx >= 0) & (end_idx <= signals.shape[1]) & (start_idx < end_idx)
+        for row in stimuli[~valid].itertuples(index=False):
+            print(f"Некорректный интервал: {row.label} [{row.start}, {row.end}]")
+        stimuli = stimuli[valid]
+
+        # ВЫЧИСЛЕНИЕ ПАРАМЕТРОВ НА ИСХОДНЫХ СИГНАЛАХ (без нормализации)
+        line_lengths_real, mean_values_real = interval_features(
+            signals, start_idx[valid], end_idx[valid]
+        )
+
+        # Собираем результаты по столбцам
+        columns = {
+            "File": base_name,
+            "Label": stimuli["label"].astype(object).to_numpy(),
+            "Start_Time": stimuli["start"].to_numpy(),
+            "End_Time": stimuli["end"].to_numpy(),
+            "Duration": (stimuli["end"] - stimuli["start"]).to_numpy(),
+        }
+
+        # Добавляем реальные характеристики для каждого канала
+        for i, label in enumerate(labels):
+            columns[f"{label}_Line_Length_Real"] = line_lengths_real[i]
+            columns[f"{label}_Mean_Real"] = mean_values_real[i]
+
+        # Добавляем нормализованные характеристики (заполним позже)
+        # (Пока просто копируем реальные значения, нормализация будет после)
+        for i, label in enumerate(labels):
+            columns[f"{label}_Line_Length"] = line_lengths_real[i].copy()
+            columns[f"{label}_Mean"] = mean_values_real[i].copy()
+
+        return pd.DataFrame(columns)
 
     except Exception as e:
         print(f"Ошибка обработки {file_path}: {str(e)}")
@@ -160,7 +131,7 @@ def main():
     log_dir = current_dir / "data/prepared_txt/"
 
     # Сбор и обработка файлов
-    all_results = []
+    all_results = []  # DataFrame по каждому файлу
 
     for file_path in data_dir.glob("*_processed.npy"):
         # Формируем пути к файлам
@@ -175,13 +146,13 @@ def main():
         # Обрабатываем файл
         print(f"Обработка файла: {file_path.name}")
         file_results = process_file(file_path, log_path)
-        if file_results:
-            all_results.extend(file_results)
+        if file_results is not None and len(file_results):
+            all_results.append(file_results)
             print(f"  Найдено интервалов: {len(file_results)}")
 
     # Сохранение результатов
     if all_results:
-        df = pd.DataFrame(all_results)
+        df = pd.concat(all_results, ignore_index=True)
 
         # Упорядочиваем столбцы: мета, реальные, нормированные
         meta_cols = ["File", "Label", "Start_Time", "End_Time", "Duration"]
@@ -196,6 +167,8 @@ def main():
         # Сохранение результатов
         output_path = data_dir / "Signal_Analysis_Results_Normalized.xlsx"
         df.to_excel(str(output_path), index=False)
+        # Для следующих этапов: таблица в хранилище признаков (после отчета)
+        save_features("signal_features", df, current_dir / "data")
         print(f"\nРезультаты сохранены в: {output_path}")
         print(f"Обработано файлов: {len(set(df['File']))}")
         print(f"Обработано интервалов: {len(df)}")
@@ -0,0 +1,185 @@
+"""
+Таблица стимулов из лог-файлов маркеров (data/prepared_txt)
+
+Строка лога: время, время, маркер, метка (через табуляцию или пробелы).
+Маркер 5 открывает стимул, 6 закрывает его. Лог читается целиком, числа
+переводятся одним массивом, а пары 5/6 находятся сравнением соседних
+событий: закрывающий маркер относится к стимулу, только если предыдущее
+событие 5/6 было открывающим (так же работал построчный автомат
+parse_log_file).
+
+Результат - таблица с типизированными столбцами label, start, end,
+start_idx, end_idx (индексы отсчетов при заданной частоте). Ее можно
+сохранить рядом с предобработанным сигналом (`<имя>_stimuli.json`) и
+переиспользовать, пока лог и частота не изменились.
+"""
+
+import json
+import os
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+START_MARKER = 5
+END_MARKER = 6
+CACHE_VERSION = 1
+
+STIMULUS_DTYPES = {
+    "label": "string",
+    "start": "float64",
+    "end": "float64",
+    "start_idx": "int64",
+    "end_idx": "int64",
+}
+
+
+def empty_table():
+    """Пустая таблица стимулов с нужными типами столбцов"""
+    return _stimulus_frame([], [], [], [], [])
+
+
+def _stimulus_frame(label, start, end, start_idx=None, end_idx=None):
+    """Таблица стимулов из готовых массивов с типами STIMULUS_DTYPES"""
+    columns = {
+        "label": pd.array(label, dtype="string"),
+        "start": np.asarray(start, dtype="float64"),
+        "end": np.asarray(end, dtype="float64"),
+    }
+    if start_idx is not None:
+        columns["start_idx"] = np.asarray(start_idx, dtype="int64")
+        columns["end_idx"] = np.asarray(end_idx, dtype="int64")
+    return pd.DataFrame(columns)
+
+
+def parse_marker_log(log_path):
+    """Пары маркеров 5/6 лог-файла: таблица (label, start, end)
+
+    Поля строки разделяются пробелами/табуляцией. Метка берется у
+    открывающего маркера (слова после третьего поля через пробел). Строки,
+    где время или маркер не числа, пропускаются с сообщением; открывающий
+    маркер, за которым снова идет открывающий, дает предупреждение.
+    """
+    with open(log_path, encoding="utf-8-sig") as fh:
+        text = fh.read().replace("\ufeff", "")
+    # Строки короче трех полей не содержат маркера
+    rows = [row for row in map(str.split, text.splitlines()) if len(row) >= 3]
+    times = _to_float([row[0] for row in rows])
+    markers = _to_float([row[2] for row in rows])
+    bad = np.isnan(times) | np.isnan(markers) | (markers != np.floor(markers))
+    for i in np.flatnonzero(bad):
+        print(f"Ошибка обработки строки: {' '.join(rows[i])}")
+
+    events = np.flatnonzero(~bad & np.isin(markers, [START_MARKER, END_MARKER]))
+    times, markers = times[events], markers[events]
+
+    # Закрывающий маркер, перед которым стоит открывающий, закрывает стимул
+    is_start = markers == START_MARKER
+    closes = np.flatnonzero((markers[1:] == END_MARKER) & is_start[:-1]) + 1
+    # Открывающий маркер, за которым снова открывающий, остался незакрытым
+    for i in np.flatnonzero(is_start[:-1] & is_start[1:]):
+        label = _label(rows[events[i]])
+        print(f"Предупреждение: незакрытый интервал для метки '{label}'")
+
+    labels = [_label(rows[events[i]]) for i in closes - 1]
+    return _stimulus_frame(labels, times[closes - 1], times[closes])
+
+
+def _to_float(values):
+    """Числа из строк; нечисловые значения -> NaN"""
+    try:
+        return np.array(values, dtype="float64")
+    except ValueError:
+        return pd.to_numeric(values, errors="coerce").astype("float64")
+
+
+def _label(row):
+    """Метка строки: слова после маркера через один пробел или None"""
+    return " ".join(row[3:]) or None
+
+
+def with_sample_indices(table, sampling_rate):
+    """Добавление индексов отсчетов start_idx/end_idx (усечение, как int())"""
+    start, end = table["start"].to_numpy(), table["end"].to_numpy()
+    return _stimulus_frame(
+        table["label"],
+        start,
+        end,
+        (start * sampling_rate).astype(np.int64),
+        (end * sampling_rate).astype(np.int64),
+    )
+
+
+def stimuli_path(npy_path):
+    """Файл таблицы стимулов рядом с `<имя>_processed.npy`"""
+    npy_path = pathlib.Path(npy_path)
+    return npy_path.with_name(
+        npy_path.name.replace("_processed.npy", "_stimuli.json")
+    )
+
+
+def _source_stamp(log_path):
+    stat = os.stat(log_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _read_cached(cache_path, log_path, sampling_rate):
+    """Таблица из кэша или None, если кэш отсутствует или устарел"""
+    try:
+        with open(cache_path, encoding="utf-8") as fh:
+            cached = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if (
+        cached.get("version") != CACHE_VERSION
+        or cached.get("sampling_rate") != sampling_rate
+        or cached.get("source") != _source_stamp(log_path)
+    ):
+        return None
+    return _stimulus_frame(*(cached["columns"][name] for name in STIMULUS_DTYPES))
+
+
+def _write_cached(cache_path, log_path, sampling_rate, table):
+    cached = {
+        "version": CACHE_VERSION,
+        "sampling_rate": sampling_rate,
+        "source": _source_stamp(log_path),
+        "columns": {
+            name: [None if pd.isna(v) else v for v in table[name].tolist()]
+            for name in STIMULUS_DTYPES
+        },
+    }
+    tmp_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(cached, fh, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Не удалось сохранить таблицу стимулов {cache_path}: {e}")
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def load_stimuli(log_path, sampling_rate, npy_path=None):
+    """Таблица стимулов лог-файла с индексами отсчетов
+
+    При заданном npy_path (предобработанный сигнал) таблица кэшируется в
+    stimuli_path(npy_path) и пересобирается только при изменении лога
+    (размер, mtime) или частоты дискретизации. Ошибка чтения лога дает
+    пустую таблицу.
+    """
+    cache_path = stimuli_path(npy_path) if npy_path is not None else None
+    try:
+        if cache_path is not None:
+            table = _read_cached(cache_path, log_path, sampling_rate)
+            if table is not None:
+                return table
+        table = with_sample_indices(parse_marker_log(log_path), sampling_rate)
+    except Exception as e:
+        print(f"Ошибка чтения лог-файла {log_path}: {str(e)}")
+        return empty_table()
+
+    if cache_path is not None:
+        _write_cached(cache_path, log_path, sampling_rate, table)
+    return table
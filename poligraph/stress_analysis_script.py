@@ -3,30 +3,41 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pathlib
-import re
 import warnings
+
+from feature_store import load_features
+from stress_scoring import RULES_PATH, level, load_rules, score
+
 warnings.filterwarnings('ignore')
 
 # Настройка matplotlib для русского языка
 plt.rcParams['font.family'] = ['Arial Unicode MS', 'Tahoma', 'sans-serif']
 plt.rcParams['axes.unicode_minus'] = False
 
+# Показатели SCR_analysis_results.csv -> столбцы индикаторов участника
+SCR_METRICS = {
+    'NS-SCR': 'NS_SCR',
+    'Amp-SCR': 'Amp_SCR',
+    'Recovery-Time': 'Recovery_Time',
+    'Line-Length': 'SCR_Line_Length',
+    'Raw-SD': 'SCR_Raw_SD',
+}
+# Нормированные показатели интервалов -> показатели текста
+TEXT_METRICS = {
+    'scr r_Line_Length': 'scr_line_length',
+    'scr r_Mean': 'scr_mean',
+    'HR (calculated)_Line_Length': 'hr_line_length',
+}
+
 class StressAnalyzer:
     """Класс для анализа данных стресса участников"""
     
-    def __init__(self, data_path="poligraph/data"):
+    def __init__(self, data_path="poligraph/data", rules_path=RULES_PATH):
         self.data_path = pathlib.Path(data_path)
+        self.scoring_rules = load_rules(rules_path)
         self.participant_data = {}
         self.stress_results = pd.DataFrame()
         
-    def extract_participant_id(self, filename):
-        """Извлекает ID участника из имени файла"""
-        pattern = r'(\d{4}[A-Z]{3})_exp1'
-        match = re.search(pattern, filename)
-        if match:
-            return match.group(1)
-        return None
-    
     def load_spilberg_data(self):
         """Загружает данные теста Спилберга"""
         try:
@@ -43,22 +54,16 @@ class StressAnalyzer:
     def load_physiological_data(self):
         """Загружает физиологические данные"""
         # Загрузка SCR данных
-        scr_file = self.data_path / "result" / "SCR_analysis_results.csv"
         try:
-            scr_df = pd.read_csv(scr_file, sep=';', decimal=',')
-            scr_df['Participant_ID'] = scr_df['File'].apply(self.extract_participant_id)
-            scr_df = scr_df[scr_df['Participant_ID'].notna()]
+            scr_df = load_features("scr_features", self.data_path)
             print(f"Загружены SCR данные: {len(scr_df)} записей")
         except Exception as e:
             print(f"Ошибка загрузки SCR данных: {e}")
             scr_df = pd.DataFrame()
         
         # Загрузка нормализованных данных
-        normalized_file = self.data_path / "result" / "Signal_Analysis_Results_Normalized.xlsx"
         try:
-            norm_df = pd.read_excel(normalized_file)
-            norm_df['Participant_ID'] = norm_df['File'].apply(self.extract_participant_id)
-            norm_df = norm_df[norm_df['Participant_ID'].notna()]
+            norm_df = load_features("signal_features", self.data_path)
             print(f"Загружены нормализованные данные: {len(norm_df)} записей")
         except Exception as e:
             print(f"Ошибка загрузки нормализованных данных: {e}")
@@ -66,136 +71,113 @@ class StressAnalyzer:
         
         return scr_df, norm_df
     
+    @staticmethod
+    def _to_number(values):
+        """Числовой столбец; строки с десятичной запятой переводятся в числа"""
+        if pd.api.types.is_numeric_dtype(values):
+            return values.astype(float)
+        return pd.to_numeric(values.astype(str).str.replace(',', '.'), errors='coerce')
+    
     def calculate_stress_indicators(self, scr_df, norm_df):
-        """Вычисляет индикаторы стресса для каждого участника"""
-        stress_indicators = []
+        """Вычисляет индикаторы стресса для каждого участника
         
-        # Группировка по участникам
-        participants = scr_df['Participant_ID'].unique()
+        Показатели берутся из первой строки каналов 'scr r' и 'HR (calculated)'
+        участника (одна сводная таблица участник x канал), участники без
+        канала 'scr r' пропускаются. Пропуски считаются нулями.
+        """
+        # Первая строка каждого канала участника -> сводная таблица
+        channels = ['scr r', 'HR (calculated)']
+        first_rows = scr_df[scr_df['Channel'].isin(channels)].drop_duplicates(['Participant_ID', 'Channel'])
+        participant_ids = first_rows['Participant_ID'].astype(object)
+        metrics = first_rows[list(SCR_METRICS)].apply(self._to_number)
+        pivot = metrics.set_index([participant_ids, first_rows['Channel']]).unstack('Channel')
+        pivot = pivot.reindex(columns=pd.MultiIndex.from_product([list(SCR_METRICS), channels]))
         
-        for participant in participants:
-            participant_scr = scr_df[scr_df['Participant_ID'] == participant]
-            participant_norm = norm_df[norm_df['Participant_ID'] == participant]
-            
-            # Анализируем данные SCR (кожно-гальваническая реакция)
-            scr_data = participant_scr[participant_scr['Channel'] == 'scr r']
-            if not scr_data.empty:
-                scr_row = scr_data.iloc[0]
-                
-                # Извлекаем ключевые показатели стресса
-                ns_scr = float(str(scr_row['NS-SCR']).replace(',', '.')) if pd.notna(scr_row['NS-SCR']) else 0
-                amp_scr = float(str(scr_row['Amp-SCR']).replace(',', '.')) if pd.notna(scr_row['Amp-SCR']) else 0
-                recovery_time = float(str(scr_row['Recovery-Time']).replace(',', '.')) if pd.notna(scr_row['Recovery-Time']) else 0
-                line_length = float(str(scr_row['Line-Length']).replace(',', '.')) if pd.notna(scr_row['Line-Length']) else 0
-                raw_sd = float(str(scr_row['Raw-SD']).replace(',', '.')) if pd.notna(scr_row['Raw-SD']) else 0
-                
-                # Анализируем данные HR (частота сердечных сокращений)
-                hr_data = participant_scr[participant_scr['Channel'] == 'HR (calculated)']
-                hr_line_length = 0
-                if not hr_data.empty:
-                    hr_line_length = float(str(hr_data.iloc[0]['Line-Length']).replace(',', '.')) if pd.notna(hr_data.iloc[0]['Line-Length']) else 0
-                
-                # Рассчитываем составной индекс стресса
-                stress_score = self.calculate_stress_score(ns_scr, amp_scr, recovery_time, line_length, raw_sd, hr_line_length)
-                
-                # Анализ по текстам (если есть данные по Label)
-                text_analysis = {}
-                if not participant_norm.empty:
-                    for i in range(1, 7):  # Тексты 1-6
-                        text_data = participant_norm[participant_norm['Label'].astype(str).str.contains(str(i), na=False)]
-                        if not text_data.empty:
-                            # Усредняем показатели по текстам
-                            text_stress = text_data[['scr r_Line_Length', 'scr r_Mean', 'HR (calculated)_Line_Length']].mean()
-                            text_analysis[f'text_{i}'] = {
-                                'scr_line_length': text_stress.get('scr r_Line_Length', 0),
-                                'scr_mean': text_stress.get('scr r_Mean', 0),
-                                'hr_line_length': text_stress.get('HR (calculated)_Line_Length', 0)
-                            }
-                
-                stress_indicators.append({
-                    'Participant_ID': participant,
-                    'NS_SCR': ns_scr,
-                    'Amp_SCR': amp_scr,
-                    'Recovery_Time': recovery_time,
-                    'SCR_Line_Length': line_length,
-                    'SCR_Raw_SD': raw_sd,
-                    'HR_Line_Length': hr_line_length,
-                    'Stress_Score': stress_score,
-                    'Text_Analysis': text_analysis
-                })
-        
-        return pd.DataFrame(stress_indicators)
+        # Участники в порядке появления в scr_df
+        with_scr = set(participant_ids[first_rows['Channel'] == 'scr r'])
+        participants = [p for p in pd.unique(scr_df['Participant_ID'].astype(object)) if p in with_scr]
+        pivot = pivot.reindex(participants).fillna(0)
+        
+        stress_df = pd.DataFrame({'Participant_ID': participants})
+        for column, name in SCR_METRICS.items():
+            stress_df[name] = pivot[(column, 'scr r')].to_numpy()
+        stress_df['HR_Line_Length'] = pivot[('Line-Length', 'HR (calculated)')].to_numpy()
+        
+        # Рассчитываем составной индекс стресса
+        stress_df['Stress_Score'] = self.calculate_stress_score(
+            stress_df['NS_SCR'], stress_df['Amp_SCR'], stress_df['Recovery_Time'],
+            stress_df['SCR_Line_Length'], stress_df['SCR_Raw_SD'], stress_df['HR_Line_Length']
+        )
+        
+        # Анализ по текстам (словарь text_i -> средние показатели)
+        text_analysis = {participant: {} for participant in participants}
+        if not norm_df.empty:
+            text_means = self.calculate_text_indicators(norm_df)
+            for row in text_means.itertuples(index=False):
+                if row.Participant_ID in text_analysis:
+                    text_analysis[row.Participant_ID][f'text_{row.Text_Number}'] = {
+                        name: getattr(row, name) for name in TEXT_METRICS.values()
+                    }
+        stress_df['Text_Analysis'] = [text_analysis[participant] for participant in participants]
+        
+        return stress_df
+    
+    def calculate_text_indicators(self, norm_df):
+        """Средние нормированные показатели участников по текстам 1-6
+        
+        Строка относится к тексту i, если Label содержит цифру i. Все
+        тексты обрабатываются одной группировкой (участник, текст).
+        """
+        labels = norm_df['Label'].astype(str)
+        parts = []
+        for i in range(1, 7):  # Тексты 1-6
+            text_rows = labels.str.contains(str(i), na=False, regex=False)
+            parts.append(norm_df.loc[text_rows, ['Participant_ID', *TEXT_METRICS]].assign(Text_Number=i))
+        texts = pd.concat(parts)
+        texts['Participant_ID'] = texts['Participant_ID'].astype(object)
+        
+        # Усредняем показатели по текстам
+        text_means = texts.groupby(['Participant_ID', 'Text_Number'])[list(TEXT_METRICS)].mean()
+        return text_means.rename(columns=TEXT_METRICS).reset_index()
     
     def calculate_stress_score(self, ns_scr, amp_scr, recovery_time, line_length, raw_sd, hr_line_length):
-        """Рассчитывает составной индекс стресса"""
-        # Нормализуем показатели (простая z-score нормализация)
-        # Высокие значения NS-SCR, Amp-SCR, Line-Length, Raw-SD указывают на стресс
-        # Низкое время восстановления также может указывать на стресс
-        
-        score = 0
-        if ns_scr > 80:  # Много SCR пиков
-            score += 2
-        elif ns_scr > 60:
-            score += 1
-            
-        if amp_scr > 1.5:  # Высокая амплитуда
-            score += 2
-        elif amp_scr > 1.0:
-            score += 1
-            
-        if recovery_time < 1.5:  # Быстрое восстановление может указывать на стресс
-            score += 1
-            
-        if line_length > 300:  # Высокая активность сигнала
-            score += 2
-        elif line_length > 200:
-            score += 1
-            
-        if raw_sd > 10000:  # Высокая вариативность
-            score += 2
-        elif raw_sd > 5000:
-            score += 1
-            
-        if hr_line_length > 200:  # Высокая вариативность HR
-            score += 1
+        """Рассчитывает составной индекс стресса (скаляры или массивы)
         
-        return score
+        Пороги - набор правил "participant" в scoring_rules.json: много SCR
+        пиков, высокая амплитуда и вариативность, высокая активность
+        сигнала и HR, а также быстрое восстановление указывают на стресс.
+        """
+        features = {
+            'NS_SCR': ns_scr,
+            'Amp_SCR': amp_scr,
+            'Recovery_Time': recovery_time,
+            'SCR_Line_Length': line_length,
+            'SCR_Raw_SD': raw_sd,
+            'HR_Line_Length': hr_line_length,
+        }
+        return score(features, self.scoring_rules['participant'])
     
     def analyze_text_stress(self, stress_df):
         """Анализирует стресс по текстам"""
-        text_stress_results = []
+        text_stress_df = pd.DataFrame([
+            {'Participant_ID': participant_id, 'Text_Number': int(text_key.split('_')[1]), **text_data}
+            for participant_id, text_analysis in zip(stress_df['Participant_ID'], stress_df['Text_Analysis'])
+            for text_key, text_data in text_analysis.items()
+        ])
+        if text_stress_df.empty:
+            return text_stress_df
+        text_stress_df = text_stress_df.rename(columns={
+            'scr_line_length': 'SCR_Line_Length',
+            'scr_mean': 'SCR_Mean',
+            'hr_line_length': 'HR_Line_Length',
+        })
         
-        for _, participant in stress_df.iterrows():
-            participant_id = participant['Participant_ID']
-            text_analysis = participant['Text_Analysis']
-            
-            for text_num in range(1, 7):
-                text_key = f'text_{text_num}'
-                if text_key in text_analysis:
-                    text_data = text_analysis[text_key]
-                    
-                    # Определяем стресс по тексту
-                    text_stress_score = 0
-                    if text_data['scr_line_length'] > 0.5:  # Нормализованные значения
-                        text_stress_score += 2
-                    if text_data['scr_mean'] > 0.5:
-                        text_stress_score += 2
-                    if text_data['hr_line_length'] > 0.5:
-                        text_stress_score += 1
-                    
-                    stress_level = "Высокий" if text_stress_score >= 3 else "Средний" if text_stress_score >= 2 else "Низкий"
-                    
-                    text_stress_results.append({
-                        'Participant_ID': participant_id,
-                        'Text_Number': text_num,
-                        'SCR_Line_Length': text_data['scr_line_length'],
-                        'SCR_Mean': text_data['scr_mean'],
-                        'HR_Line_Length': text_data['hr_line_length'],
-                        'Text_Stress_Score': text_stress_score,
-                        'Stress_Level': stress_level
-                    })
+        # Определяем стресс по тексту (нормализованные значения)
+        text_rules = self.scoring_rules['text']
+        text_stress_df['Text_Stress_Score'] = score(text_stress_df, text_rules)
+        text_stress_df['Stress_Level'] = level(text_stress_df['Text_Stress_Score'], text_rules)
         
-        return pd.DataFrame(text_stress_results)
+        return text_stress_df
     
     def create_visualizations(self, stress_df, text_stress_df, spilberg_df):
         """Создает графики"""
@@ -301,9 +283,7 @@ class StressAnalyzer:
         
         # Общая таблица по участникам
         summary_table = stress_df[['Participant_ID', 'Stress_Score']].copy()
-        summary_table['Stress_Level'] = summary_table['Stress_Score'].apply(
-            lambda x: 'Высокий' if x >= 6 else 'Средний' if x >= 3 else 'Низкий'
-        )
+        summary_table['Stress_Level'] = level(summary_table['Stress_Score'], self.scoring_rules['participant'])
         
         # Добавляем информацию по текстам
         if not text_stress_df.empty:
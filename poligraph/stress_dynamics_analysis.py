@@ -3,36 +3,38 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pathlib
-import re
 import warnings
 from scipy import stats
+
+from feature_store import load_features, save_features
+from participants import ParticipantIndex
+from stress_scoring import RULES_PATH, load_rules, score
+
 warnings.filterwarnings('ignore')
 
 # Настройка matplotlib для русского языка
 plt.rcParams['font.family'] = ['Arial Unicode MS', 'Tahoma', 'sans-serif']
 plt.rcParams['axes.unicode_minus'] = False
 
+# Нормированные показатели интервала -> метрики стресса по тексту
+STRESS_METRICS = {
+    'scr r_Line_Length': 'SCR_Line_Length',
+    'scr r_Mean': 'SCR_Mean',
+    'HR (calculated)_Line_Length': 'HR_Line_Length',
+    'HR (calculated)_Mean': 'HR_Mean',
+}
+
 class StressDynamicsAnalyzer:
     """Класс для анализа динамики стресса до и после индукции стресса"""
     
-    def __init__(self, data_path="poligraph/data"):
+    def __init__(self, data_path="poligraph/data", rules_path=RULES_PATH):
         self.data_path = pathlib.Path(data_path)
+        self.scoring_rules = load_rules(rules_path)
         
-    def extract_participant_id(self, filename):
-        """Извлекает ID участника из имени файла"""
-        pattern = r'(\d{4}[A-Z]{3})_exp1'
-        match = re.search(pattern, filename)
-        if match:
-            return match.group(1)
-        return None
-    
     def load_normalized_data(self):
         """Загружает нормализованные данные"""
-        normalized_file = self.data_path / "result" / "Signal_Analysis_Results_Normalized.xlsx"
         try:
-            norm_df = pd.read_excel(normalized_file)
-            norm_df['Participant_ID'] = norm_df['File'].apply(self.extract_participant_id)
-            norm_df = norm_df[norm_df['Participant_ID'].notna()]
+            norm_df = load_features("signal_features", self.data_path)
             
             # Конвертируем Label в числовой формат для текстов 1-6
             norm_df['Text_Number'] = pd.to_numeric(norm_df['Label'], errors='coerce')
@@ -46,11 +48,8 @@ class StressDynamicsAnalyzer:
     
     def load_scr_data(self):
         """Загружает SCR данные"""
-        scr_file = self.data_path / "result" / "SCR_analysis_results.csv"
         try:
-            scr_df = pd.read_csv(scr_file, sep=';', decimal=',')
-            scr_df['Participant_ID'] = scr_df['File'].apply(self.extract_participant_id)
-            scr_df = scr_df[scr_df['Participant_ID'].notna()]
+            scr_df = load_features("scr_features", self.data_path)
             print(f"Загружены SCR данные: {len(scr_df)} записей")
             return scr_df
         except Exception as e:
@@ -58,96 +57,83 @@ class StressDynamicsAnalyzer:
             return pd.DataFrame()
     
     def calculate_stress_metrics(self, norm_df):
-        """Рассчитывает метрики стресса для каждого участника и текста"""
-        stress_data = []
-        
-        for participant in norm_df['Participant_ID'].unique():
-            participant_data = norm_df[norm_df['Participant_ID'] == participant]
-            
-            for text_num in range(1, 7):
-                text_data = participant_data[participant_data['Text_Number'] == text_num]
-                
-                if not text_data.empty:
-                    # Извлекаем ключевые показатели стресса
-                    scr_line_length = text_data['scr r_Line_Length'].iloc[0] if 'scr r_Line_Length' in text_data.columns else 0
-                    scr_mean = text_data['scr r_Mean'].iloc[0] if 'scr r_Mean' in text_data.columns else 0
-                    hr_line_length = text_data['HR (calculated)_Line_Length'].iloc[0] if 'HR (calculated)_Line_Length' in text_data.columns else 0
-                    hr_mean = text_data['HR (calculated)_Mean'].iloc[0] if 'HR (calculated)_Mean' in text_data.columns else 0
-                    
-                    # Рассчитываем составной индекс стресса (более чувствительный)
-                    stress_score = self.calculate_text_stress_score(scr_line_length, scr_mean, hr_line_length, hr_mean)
-                    
-                    stress_data.append({
-                        'Participant_ID': participant,
-                        'Text_Number': text_num,
-                        'SCR_Line_Length': scr_line_length,
-                        'SCR_Mean': scr_mean,
-                        'HR_Line_Length': hr_line_length,
-                        'HR_Mean': hr_mean,
-                        'Stress_Score': stress_score,
-                        'Phase': 'Базовая линия' if text_num <= 3 else 'После индукции стресса'
-                    })
-        
-        return pd.DataFrame(stress_data)
+        """Рассчитывает метрики стресса для каждого участника и текста
+        
+        Для пары (участник, текст 1-6) берется первая строка интервала;
+        строки упорядочены по первому появлению участника и номеру текста.
+        """
+        texts = norm_df[norm_df['Text_Number'].isin(range(1, 7))]
+        first_rows = texts.drop_duplicates(['Participant_ID', 'Text_Number'])
+        participant_ids = first_rows['Participant_ID'].astype(object)
+        participant_order = pd.Categorical(
+            participant_ids, categories=pd.unique(norm_df['Participant_ID'].astype(object))
+        ).codes
+        order = np.lexsort((first_rows['Text_Number'].to_numpy(), participant_order))
+        first_rows = first_rows.iloc[order]
+        
+        text_numbers = first_rows['Text_Number'].to_numpy().astype(int)
+        stress_df = pd.DataFrame({
+            'Participant_ID': participant_ids.to_numpy()[order],
+            'Text_Number': text_numbers,
+        })
+        # Извлекаем ключевые показатели стресса (отсутствующий столбец -> 0)
+        for column, name in STRESS_METRICS.items():
+            stress_df[name] = first_rows[column].to_numpy() if column in first_rows.columns else 0
+        
+        # Рассчитываем составной индекс стресса (более чувствительный)
+        stress_df['Stress_Score'] = self.calculate_text_stress_score(
+            stress_df['SCR_Line_Length'], stress_df['SCR_Mean'],
+            stress_df['HR_Line_Length'], stress_df['HR_Mean']
+        )
+        stress_df['Phase'] = np.where(text_numbers <= 3, 'Базовая линия', 'После индукции стресса')
+        
+        return stress_df
     
     def calculate_text_stress_score(self, scr_line_length, scr_mean, hr_line_length, hr_mean):
-        """Рассчитывает более чувствительный индекс стресса для текста"""
-        score = 0
-        
-        # Используем более низкие пороги для выявления тонких различий
-        if scr_line_length > 0.2:  # Снижен порог
-            score += 2
-        elif scr_line_length > 0.0:
-            score += 1
-            
-        if scr_mean > 0.2:  # Снижен порог
-            score += 2
-        elif scr_mean > 0.0:
-            score += 1
-            
-        if hr_line_length > 0.2:  # Снижен порог
-            score += 1
-        elif hr_line_length > 0.0:
-            score += 0.5
-            
-        if hr_mean > 0.2:
-            score += 1
-        elif hr_mean > 0.0:
-            score += 0.5
-        
-        return score
+        """Рассчитывает более чувствительный индекс стресса для текста
+        
+        Набор правил "dynamics_text" в scoring_rules.json: более низкие
+        пороги для выявления тонких различий. Принимает скаляры или массивы.
+        """
+        features = {
+            'SCR_Line_Length': scr_line_length,
+            'SCR_Mean': scr_mean,
+            'HR_Line_Length': hr_line_length,
+            'HR_Mean': hr_mean,
+        }
+        return score(features, self.scoring_rules['dynamics_text'])
     
     def analyze_stress_dynamics(self, stress_df):
-        """Анализирует динамику стресса до и после индукции"""
+        """Анализирует динамику стресса до и после индукции
+        
+        Все показатели считаются по столбцам таблицы участник x текст:
+        участники без текстов одной из фаз пропускаются.
+        """
+        scores = stress_df.pivot(index='Participant_ID', columns='Text_Number', values='Stress_Score')
+        scores = scores.reindex(columns=range(1, 7))
         
         # Группируем по фазам эксперимента
-        baseline_stress = stress_df[stress_df['Text_Number'].isin([1, 2, 3])].groupby('Participant_ID')['Stress_Score'].mean()
-        post_induction_stress = stress_df[stress_df['Text_Number'].isin([4, 5, 6])].groupby('Participant_ID')['Stress_Score'].mean()
+        baseline_scores = scores[[1, 2, 3]]
+        post_induction_scores = scores[[4, 5, 6]]
+        both_phases = baseline_scores.notna().any(axis=1) & post_induction_scores.notna().any(axis=1)
         
         # Анализируем изменения
-        dynamics_data = []
-        for participant in baseline_stress.index:
-            if participant in post_induction_stress.index:
-                baseline = baseline_stress[participant]
-                post_induction = post_induction_stress[participant]
-                change = post_induction - baseline
-                change_percent = (change / baseline * 100) if baseline > 0 else 0
-                
-                # Специальный анализ 4-го текста (должен быть пик стресса)
-                text4_data = stress_df[(stress_df['Participant_ID'] == participant) & (stress_df['Text_Number'] == 4)]
-                text4_stress = text4_data['Stress_Score'].iloc[0] if not text4_data.empty else 0
-                
-                dynamics_data.append({
-                    'Participant_ID': participant,
-                    'Baseline_Stress': baseline,
-                    'Post_Induction_Stress': post_induction,
-                    'Stress_Change': change,
-                    'Stress_Change_Percent': change_percent,
-                    'Text4_Stress': text4_stress,
-                    'Responded_to_Induction': change > 0.5  # Порог реакции на индукцию
-                })
-        
-        return pd.DataFrame(dynamics_data)
+        baseline = baseline_scores[both_phases].mean(axis=1)
+        post_induction = post_induction_scores[both_phases].mean(axis=1)
+        change = post_induction - baseline
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change_percent = np.where(baseline > 0, change / baseline * 100, 0)
+        
+        return pd.DataFrame({
+            'Participant_ID': baseline.index.to_numpy(),
+            'Baseline_Stress': baseline.to_numpy(),
+            'Post_Induction_Stress': post_induction.to_numpy(),
+            'Stress_Change': change.to_numpy(),
+            'Stress_Change_Percent': change_percent,
+            # Специальный анализ 4-го текста (должен быть пик стресса)
+            'Text4_Stress': scores.loc[both_phases, 4].fillna(0).to_numpy(),
+            'Responded_to_Induction': (change > 0.5).to_numpy()  # Порог реакции на индукцию
+        })
     
     def create_dynamics_visualizations(self, stress_df, dynamics_df):
         """Создает графики динамики стресса"""
@@ -192,17 +178,18 @@ class StressDynamicsAnalyzer:
         
         participants_with_response = dynamics_df[dynamics_df['Responded_to_Induction']]['Participant_ID'].tolist()
         participants_no_response = dynamics_df[~dynamics_df['Responded_to_Induction']]['Participant_ID'].tolist()
+        stress_by_participant = ParticipantIndex(stress_df)
         
         # Рисуем траектории респондеров
         for participant in participants_with_response:
-            participant_data = stress_df[stress_df['Participant_ID'] == participant]
+            participant_data = stress_by_participant.rows(participant)
             plt.plot(participant_data['Text_Number'], participant_data['Stress_Score'], 
                     'o-', linewidth=2, alpha=0.7, color='red', 
                     label='Реагировали на стресс' if participant == participants_with_response[0] else "")
         
         # Рисуем траектории нон-респондеров
         for participant in participants_no_response:
-            participant_data = stress_df[stress_df['Participant_ID'] == participant]
+            participant_data = stress_by_participant.rows(participant)
             plt.plot(participant_data['Text_Number'], participant_data['Stress_Score'], 
                     'o-', linewidth=1, alpha=0.5, color='blue',
                     label='Не реагировали на стресс' if participant == participants_no_response[0] else "")
@@ -410,6 +397,8 @@ class StressDynamicsAnalyzer:
         results_path = pathlib.Path("poligraph/stress_dynamics_results")
         stress_df.to_excel(results_path / 'detailed_stress_by_text.xlsx', index=False)
         dynamics_df.to_excel(results_path / 'stress_dynamics_summary.xlsx', index=False)
+        save_features("stress_by_text", stress_df, self.data_path)
+        save_features("stress_dynamics", dynamics_df, self.data_path)
         
         print("\n=== АНАЛИЗ ДИНАМИКИ ЗАВЕРШЕН ===")
         print("Результаты сохранены в папке: poligraph/stress_dynamics_results/")
@@ -11,11 +11,14 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-import re
 from scipy import stats
 from typing import Dict, List, Tuple
 import warnings
 
+from feature_store import load_features
+from participants import ParticipantIndex
+from responder_registry import load_registry, responder_ids
+
 warnings.filterwarnings('ignore')
 
 # Настройка matplotlib для русского языка и красивых графиков
@@ -32,8 +35,8 @@ class StressRespondersVisualizer:
     def __init__(self, data_path: str = "poligraph/data"):
         self.data_path = pathlib.Path(data_path)
         
-        # Участники для анализа
-        self.responders = ['1707LTA', '1807KNV', '1607KYA', '1807OVA', '1807ZUG']
+        # Участники для анализа: респондеры с данными полиграфа из реестра
+        self.responders = responder_ids(load_registry(self.data_path))
         
         # Настройки графиков
         self.colors = {
@@ -44,22 +47,10 @@ class StressRespondersVisualizer:
             'ppg': '#C73E1D'          # ФПГ
         }
         
-    def extract_participant_id(self, filename: str) -> str:
-        """Извлекает ID участника из имени файла"""
-        pattern = r'(\d{4}[A-Z]{3})_exp1'
-        match = re.search(pattern, filename)
-        if match:
-            return match.group(1)
-        return None
-    
     def load_physiological_data(self) -> pd.DataFrame:
         """Загружает физиологические данные из нормализованного файла"""
-        normalized_file = self.data_path / "result" / "Signal_Analysis_Results_Normalized.xlsx"
-        
         try:
-            df = pd.read_excel(normalized_file)
-            df['Participant_ID'] = df['File'].apply(self.extract_participant_id)
-            df = df[df['Participant_ID'].notna()]
+            df = load_features("signal_features", self.data_path)
             
             # Фильтруем только респондеров
             df = df[df['Participant_ID'].isin(self.responders)]
@@ -83,12 +74,13 @@ class StressRespondersVisualizer:
     def calculate_stress_metrics(self, df: pd.DataFrame) -> pd.DataFrame:
         """Рассчитывает комплексный индекс стресса"""
         metrics = []
+        df_by_participant = ParticipantIndex(df)
         
         for participant in self.responders:
-            if participant not in df['Participant_ID'].values:
+            if participant not in df_by_participant:
                 continue
                 
-            participant_data = df[df['Participant_ID'] == participant]
+            participant_data = df_by_participant.rows(participant)
             
             for text_num in range(1, 7):
                 text_data = participant_data[participant_data['Text_Number'] == text_num]
@@ -141,12 +133,13 @@ class StressRespondersVisualizer:
             ('Stress_Index', 'Индекс стресса', 'stress')
         ]
         
+        metrics_by_participant = ParticipantIndex(metrics_df)
         for idx, (metric, title, color_key) in enumerate(metrics_to_plot):
             ax = axes[idx]
             
             # Рисуем траектории для каждого респондера
             for participant in self.responders:
-                participant_data = metrics_df[metrics_df['Participant_ID'] == participant]
+                participant_data = metrics_by_participant.rows(participant)
                 if not participant_data.empty:
                     ax.plot(participant_data['Text_Number'], participant_data[metric], 
                            marker='o', linewidth=2, alpha=0.7, label=participant)
@@ -469,6 +462,7 @@ class StressRespondersVisualizer:
         ]
         
         axes = axes.flatten()
+        df_by_participant = ParticipantIndex(df)
         
         for idx, (metric_col, metric_name, units) in enumerate(metrics):
             ax = axes[idx]
@@ -479,7 +473,7 @@ class StressRespondersVisualizer:
             participant_labels = []
             
             for participant in self.responders:
-                participant_data = df[df['Participant_ID'] == participant]
+                participant_data = df_by_participant.rows(participant)
                 if not participant_data.empty and metric_col in participant_data.columns:
                     baseline = participant_data[participant_data['Period'] == 'Базовая линия (1-3)'][metric_col].mean()
                     stress = participant_data[participant_data['Period'] == 'Стресс (4-6)'][metric_col].mean()
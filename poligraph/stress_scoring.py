@@ -0,0 +1,83 @@
+"""
+Табличные правила балльной оценки стресса (scoring_rules.json)
+
+Набор правил описывает индекс стресса как сумму баллов по признакам.
+Правило - признак, возрастающие точки отсечения cuts и баллы points
+(на один больше, чем cuts): points[k] начисляется, если значение прошло
+ровно k точек отсечения. При op ">" точка пройдена, если значение строго
+больше нее, при ">=" - если не меньше (так записывается условие
+"меньше порога": cuts [1.5], points [1, 0]). Пропуск (NaN) дает 0 баллов.
+
+Уровни (levels) переводят индекс в подписи тем же способом. Пороги
+меняются правкой JSON-файла без изменения кода; все правила вычисляются
+над целыми столбцами через np.digitize.
+"""
+
+import json
+import pathlib
+
+import numpy as np
+
+RULES_PATH = pathlib.Path(__file__).parent / "scoring_rules.json"
+FORMAT_VERSION = 1
+OPS = (">", ">=")
+
+
+def load_rules(path=RULES_PATH):
+    """Наборы правил из JSON-файла: {имя набора: {"rules", "levels"}}"""
+    with open(path, encoding="utf-8") as fh:
+        config = json.load(fh)
+    if config.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Неизвестная версия правил {path}")
+
+    rule_sets = {
+        name: spec for name, spec in config.items() if name != "format_version"
+    }
+    for name, spec in rule_sets.items():
+        for rule in spec["rules"]:
+            _check_thresholds(f"{name}/{rule['feature']}", rule, "points")
+        if "levels" in spec:
+            _check_thresholds(f"{name}/levels", spec["levels"], "labels")
+    return rule_sets
+
+
+def _check_thresholds(where, spec, values_key):
+    cuts = np.asarray(spec["cuts"], dtype=float)
+    if spec.get("op", ">") not in OPS:
+        raise ValueError(f"{where}: op должен быть одним из {OPS}")
+    if np.any(np.diff(cuts) <= 0):
+        raise ValueError(f"{where}: точки отсечения должны возрастать")
+    if len(spec[values_key]) != len(cuts) + 1:
+        raise ValueError(f"{where}: {values_key} должно быть на одно больше cuts")
+
+
+def passed_cuts(values, cuts, op=">"):
+    """Число пройденных точек отсечения для каждого значения"""
+    return np.digitize(values, cuts, right=op == ">")
+
+
+def rule_points(values, rule):
+    """Баллы правила для массива значений (NaN -> 0)"""
+    values = np.asarray(values, dtype=float)
+    points = np.asarray(rule["points"])
+    earned = points[passed_cuts(values, rule["cuts"], rule.get("op", ">"))]
+    return np.where(np.isnan(values), 0, earned)
+
+
+def score(features, rule_set):
+    """Индекс стресса: сумма баллов правил набора
+
+    features - DataFrame или словарь признак -> значения (скаляры или
+    массивы). Для скалярных признаков возвращается число.
+    """
+    total = np.asarray(
+        sum(rule_points(features[rule["feature"]], rule) for rule in rule_set["rules"])
+    )
+    return total.item() if total.ndim == 0 else total
+
+
+def level(scores, rule_set):
+    """Подписи уровня стресса по индексу (levels набора правил)"""
+    levels = rule_set["levels"]
+    labels = np.asarray(levels["labels"], dtype=object)
+    return labels[passed_cuts(scores, levels["cuts"], levels.get("op", ">="))]